@@ -1,6 +1,6 @@
 import torch
 import torchvision
-from tool import imutils
+from tool import imutils, pyutils, torchutils
 import argparse
 import importlib
 import numpy as np
@@ -8,7 +8,7 @@ import voc12.data
 from torch.utils.data import DataLoader
 import torch.nn.functional as F
 import os.path
-import imageio
+import time
 from tqdm import tqdm
 
 def get_indices_in_radius(height, width, radius):
@@ -60,82 +60,141 @@ if __name__ == '__main__':
     parser.add_argument("--beta", default=8, type=int)
     parser.add_argument("--logt", default=6, type=int)
     parser.add_argument("--crf", default=False, type=bool)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--bucket_unit", default=8, type=int)  # images are padded to a multiple of this
+    parser.add_argument("--num_writers", default=4, type=int)
+    parser.add_argument("--png_compression", default=None, type=int)  # 0-9, lower is faster and larger
+    parser.add_argument("--rw_mode", default='square', choices=['square', 'power'], type=str)
+    parser.add_argument("--rw_tol", default=0., type=float)  # 0 disables early stopping
+    parser.add_argument("--rw_log", default=None, type=str)  # per-image iteration counts
+    parser.add_argument("--sparse", action='store_true')  # keep the affinity matrix sparse
+    parser.add_argument("--device", default=None, type=str)  # cpu / cuda / cuda:N, default: cuda if available
+    parser.add_argument("--num_threads", default=0, type=int)  # cpu intra-op threads, 0: torch default
+    parser.add_argument("--num_interop_threads", default=0, type=int)
+    parser.add_argument("--bf16", action='store_true')  # bf16 autocast for the backbone where supported
+    parser.add_argument("--uint8", action='store_true')  # ship uint8 images, normalize on the device
 
     args = parser.parse_args()
 
+    assert args.bucket_unit % 8 == 0
+
+    device = torchutils.get_device(args.device, args.num_threads, args.num_interop_threads)
+    if args.bf16 and not torchutils.bf16_supported(device):
+        print('bf16 is not supported on %s, running in fp32' % device)
+        args.bf16 = False
+
     if not os.path.exists(args.out_rw):
         os.makedirs(args.out_rw)
 
     model = getattr(importlib.import_module(args.network), 'Net')()
 
-    model.load_state_dict(torch.load(args.weights), strict=False)
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'), strict=False)
 
     model.eval()
-    model.cuda()
-
+    model.to(device)
+
+    if args.uint8:
+        # pad with the mean colour, which is 0 after normalization
+        img_transform = [np.asarray,
+                         imutils.PadToMultiple(args.bucket_unit, np.round(np.array(model.normalize.mean) * 255).astype(np.uint8)),
+                         imutils.HWC_to_CHW]
+    else:
+        img_transform = [np.asarray,
+                         model.normalize,
+                         imutils.PadToMultiple(args.bucket_unit),
+                         imutils.HWC_to_CHW]
     infer_dataset = voc12.data.VOC12ImageDataset(args.infer_list, voc12_root=args.voc12_root,
-                                                 transform=torchvision.transforms.Compose([np.asarray,
-                                                                                           model.normalize,
-                                                                                           imutils.HWC_to_CHW]))
-    infer_data_loader = DataLoader(infer_dataset, shuffle=False, num_workers=args.num_workers, pin_memory=True)
+                                                 transform=torchvision.transforms.Compose(img_transform))
 
-    for iter, (name, img) in tqdm(enumerate(infer_data_loader), total=len(infer_data_loader)):
+    # images with the same padded size go into the same batch
+    img_size_list = voc12.data.load_img_size_list(infer_dataset.img_name_list, args.voc12_root)
+    img_size_dict = dict(zip(infer_dataset.img_name_list, img_size_list))
+    bucket_list = [(int(np.ceil(h / args.bucket_unit) * args.bucket_unit),
+                    int(np.ceil(w / args.bucket_unit) * args.bucket_unit)) for h, w in img_size_list]
 
-        name = name[0]
-        # print(iter)
+    infer_data_loader = DataLoader(infer_dataset,
+                                   batch_sampler=torchutils.BucketBatchSampler(bucket_list, args.batch_size),
+                                   num_workers=args.num_workers, pin_memory=device.type == 'cuda')
 
-        orig_shape = img.shape
-        padded_size = (int(np.ceil(img.shape[2]/8)*8), int(np.ceil(img.shape[3]/8)*8))
+    def _sync():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
 
-        p2d = (0, padded_size[1] - img.shape[3], 0, padded_size[0] - img.shape[2])
-        img = F.pad(img, p2d)
+    write_times = []
 
-        dheight = int(np.ceil(img.shape[2]/8))
-        dwidth = int(np.ceil(img.shape[3]/8))
+    def _write(file_path, res):
+        start = time.time()
+        writer.write_image(file_path, res)
+        write_times.append(time.time() - start)
 
-        cam = np.load(os.path.join(args.cam_dir, name + '.npy'), allow_pickle=True).item()
+    writer = pyutils.AsyncWriter(num_threads=args.num_writers, max_queue=4 * args.num_writers,
+                                png_compression=args.png_compression)
+    stage_time = {'backbone': 0., 'affinity': 0., 'walk': 0.}
+    rw_iters = dict()
 
-        cam_full_arr = np.zeros((21, orig_shape[2], orig_shape[3]), np.float32)
-        for k, v in cam.items():
-            cam_full_arr[k+1] = v
+    for iter, (name_list, img) in tqdm(enumerate(infer_data_loader), total=len(infer_data_loader)):
 
-        cam_full_arr[0] = 0.27
-        cam_full_arr = np.pad(cam_full_arr, ((0, 0), (0, p2d[3]), (0, p2d[1])), mode='constant')
+        dheight = img.shape[2] // 8
+        dwidth = img.shape[3] // 8
 
         with torch.no_grad():
-            aff_mat = torch.pow(model.forward(img.cuda(), True), args.beta)
-
-            trans_mat = aff_mat / torch.sum(aff_mat, dim=0, keepdim=True)
-            for _ in range(args.logt):
-                trans_mat = torch.matmul(trans_mat, trans_mat)
-
-            cam_full_arr = torch.from_numpy(cam_full_arr)
-            cam_full_arr = F.avg_pool2d(cam_full_arr, 8, 8)
-
-            cam_vec = cam_full_arr.view(21, -1)
-            cam_rw = torch.matmul(cam_vec.cuda(), trans_mat)
-            cam_rw = cam_rw.view(1, 21, dheight, dwidth)
-
-            cam_rw = torch.nn.Upsample((img.shape[2], img.shape[3]), mode='bilinear')(cam_rw)
-
-            # if args.crf:
-            #     img_8 = img[0].numpy().transpose((1,2,0)) #F.interpolate(img, (dheight,dwidth), mode='bilinear')[0].numpy().transpose((1,2,0))
-            #     img_8 = np.ascontiguousarray(img_8)
-            #     mean = (0.485, 0.456, 0.406)
-            #     std = (0.229, 0.224, 0.225)
-            #     img_8[:,:,0] = (img_8[:,:,0]*std[0] + mean[0])*255
-            #     img_8[:,:,1] = (img_8[:,:,1]*std[1] + mean[1])*255
-            #     img_8[:,:,2] = (img_8[:,:,2]*std[2] + mean[2])*255
-            #     img_8[img_8 > 255] = 255
-            #     img_8[img_8 < 0] = 0
-            #     img_8 = img_8.astype(np.uint8)
-            #     cam_rw = cam_rw[0].cpu().numpy()
-            #     cam_rw = imutils.crf_inference(img_8, cam_rw, t=1)
-            #     cam_rw = torch.from_numpy(cam_rw).view(1, 21, img.shape[2], img.shape[3]).cuda()
-
-            _, cam_rw_pred = torch.max(cam_rw, 1)
-
-            res = np.uint8(cam_rw_pred.cpu().data[0])[:orig_shape[2], :orig_shape[3]]
-
-            # scipy.misc.imsave(os.path.join(args.out_rw, name + '.png'), res)
-            imageio.imwrite(os.path.join(args.out_rw, name + '.png'), res)
+            start = time.time()
+            with torchutils.autocast(device, args.bf16):
+                feature = model.forward_feature(torchutils.normalize_batch(img.to(device, non_blocking=True),
+                                                                           model.normalize.mean,
+                                                                           model.normalize.std))
+            feature = feature.float()
+            _sync()
+            stage_time['backbone'] += time.time() - start
+
+            for i, name in enumerate(name_list):
+                orig_shape = img_size_dict[name]
+
+                start = time.time()
+                aff_mat = model.forward_aff(feature[i:i+1], to_dense=not args.sparse, to_sparse=args.sparse)
+                trans_mat = torchutils.get_transition_matrix(aff_mat, args.beta)
+                _sync()
+                stage_time['affinity'] += time.time() - start
+
+                start = time.time()
+                cam = np.load(os.path.join(args.cam_dir, name + '.npy'), allow_pickle=True).item()
+
+                cam_full_arr = np.zeros((21, orig_shape[0], orig_shape[1]), np.float32)
+                for k, v in cam.items():
+                    cam_full_arr[k+1] = v
+
+                cam_full_arr[0] = 0.27
+                cam_full_arr = np.pad(cam_full_arr, ((0, 0), (0, img.shape[2] - orig_shape[0]),
+                                                     (0, img.shape[3] - orig_shape[1])), mode='constant')
+
+                cam_full_arr = torch.from_numpy(cam_full_arr)
+                cam_full_arr = F.avg_pool2d(cam_full_arr, 8, 8)
+
+                cam_vec = cam_full_arr.view(21, -1)
+                cam_rw, n_iters = torchutils.random_walk(cam_vec.to(device), trans_mat, args.logt,
+                                                         tol=args.rw_tol, mode=args.rw_mode)
+                cam_rw = cam_rw.view(1, 21, dheight, dwidth)
+                rw_iters[name] = n_iters
+
+                cam_rw = torch.nn.Upsample((img.shape[2], img.shape[3]), mode='bilinear')(cam_rw)
+
+                _, cam_rw_pred = torch.max(cam_rw, 1)
+
+                res = np.uint8(cam_rw_pred.cpu().data[0])[:orig_shape[0], :orig_shape[1]]
+                stage_time['walk'] += time.time() - start
+
+                # scipy.misc.imsave(os.path.join(args.out_rw, name + '.png'), res)
+                writer.submit(_write, os.path.join(args.out_rw, name + '.png'), res)
+
+    writer.close()
+    stage_time['write'] = sum(write_times)
+
+    if args.rw_log is not None:
+        with open(args.rw_log, 'w') as f:
+            for name in infer_dataset.img_name_list:
+                f.write('%s %d\n' % (name, rw_iters[name]))
+
+    n_imgs = len(infer_dataset)
+    print('random walk (%s): %.2f iterations/img on average' % (args.rw_mode, np.mean(list(rw_iters.values()))))
+    for stage in ['backbone', 'affinity', 'walk', 'write']:
+        print('%9s: %8.2fs total, %7.2fms/img' % (stage, stage_time[stage], stage_time[stage] * 1000 / n_imgs))
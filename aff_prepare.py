@@ -5,8 +5,7 @@ import argparse
 from PIL import Image
 import pandas as pd
 import multiprocessing
-import pydensecrf.densecrf as dcrf
-from pydensecrf.utils import unary_from_labels, create_pairwise_bilateral, create_pairwise_gaussian
+from tool import crf
 
 if __name__ == '__main__':
 
@@ -17,6 +16,7 @@ if __name__ == '__main__':
     parser.add_argument("--cam_dir", default=None, type=str)
     parser.add_argument("--out_crf", default=None, type=str)
     parser.add_argument("--crf_iters", default=10, type=float)
+    parser.add_argument("--crf_scale", default=1, type=float)  # > 1: CRF on the image downsampled by this factor
     parser.add_argument("--alpha", default=4, type=float)
 
     args = parser.parse_args()
@@ -31,23 +31,10 @@ if __name__ == '__main__':
     name_list = df['filename'].values
 
     # https://github.com/pigcv/AdvCAM/blob/fa08f0ad4c1f764f3ccaf36883c0ae43342d34c5/misc/imutils.py#L156
+    # (gaussian 3 / 3, bilateral 80 / 13 / 10 with the default diagonal kernel and symmetric normalization)
     def _crf_inference(img, labels, t=10, n_labels=21, gt_prob=0.7):
-        h, w = img.shape[:2]
-        d = dcrf.DenseCRF2D(w, h, n_labels)
-        U = unary_from_labels(labels, 21, gt_prob=gt_prob, zero_unsure=False)
-        d.setUnaryEnergy(U)
-        feats = create_pairwise_gaussian(sdims=(3, 3), shape=img.shape[:2])
-        d.addPairwiseEnergy(feats, compat=3,
-                            kernel=dcrf.DIAG_KERNEL,
-                            normalization=dcrf.NORMALIZE_SYMMETRIC)
-        feats = create_pairwise_bilateral(sdims=(80, 80), schan=(13, 13, 13),
-                                          img=img, chdim=2)
-        d.addPairwiseEnergy(feats, compat=10,
-                            kernel=dcrf.DIAG_KERNEL,
-                            normalization=dcrf.NORMALIZE_SYMMETRIC)
-        Q = d.inference(t)
-
-        return np.array(Q).reshape((n_labels, h, w))
+        return crf.crf_inference(img, labels=labels, t=t, n_labels=n_labels, gt_prob=gt_prob,
+                                 scale_factor=args.crf_scale, **crf.CRF_PARAMS['cam'])
 
 
     def _infer_crf_with_alpha(start, step, alpha):
@@ -64,7 +51,7 @@ if __name__ == '__main__':
             predict = np.argmax(tensor, axis=0).astype(np.uint8)
             img = Image.open(os.path.join(args.voc12_root, 'JPEGImages', name + '.jpg')).convert("RGB")
             img = np.array(img)
-            crf_array = _crf_inference(img, predict)
+            crf_array = _crf_inference(img, predict, t=int(args.crf_iters))
 
             crf_folder = args.out_crf + ('/%.2f' % alpha)
             if not os.path.exists(crf_folder):
@@ -26,12 +26,18 @@ if __name__ == '__main__':
     parser.add_argument("--voc12_root", default='VOC2012', type=str)
     parser.add_argument("--la_crf_dir", required=True, type=str)
     parser.add_argument("--ha_crf_dir", required=True, type=str)
+    parser.add_argument("--fast_jitter", action='store_true')  # imutils.ColorJitter (cv2 LUTs) instead of torchvision's
+    parser.add_argument("--device", default=None, type=str)  # cpu / cuda / cuda:N, default: cuda if available
+    parser.add_argument("--num_threads", default=0, type=int)  # cpu intra-op threads, 0: torch default
+    parser.add_argument("--num_interop_threads", default=0, type=int)
     args = parser.parse_args()
 
     pyutils.Logger(os.path.join('result', args.session_name, 'aff.log'))
 
     print(vars(args))
 
+    device = torchutils.get_device(args.device, args.num_threads, args.num_interop_threads)
+
     model = getattr(importlib.import_module(args.network), 'Net')()
 
     print(model)
@@ -46,8 +52,8 @@ if __name__ == '__main__':
                                                    imutils.RandomHorizontalFlip()
                                                ],
                                                img_transform_list=[
-                                                   transforms.ColorJitter(brightness=0.3, contrast=0.3, saturation=0.3,
-                                                                          hue=0.1),
+                                                   (imutils.ColorJitter if args.fast_jitter else transforms.ColorJitter)(
+                                                       brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1),
                                                    np.asarray,
                                                    model.normalize,
                                                    imutils.HWC_to_CHW
@@ -66,7 +72,7 @@ if __name__ == '__main__':
 
     train_data_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True,
                                    num_workers=args.num_workers,
-                                   pin_memory=True, drop_last=True, worker_init_fn=worker_init_fn)
+                                   pin_memory=device.type == 'cuda', drop_last=True, worker_init_fn=worker_init_fn)
     max_step = len(train_dataset) // args.batch_size * args.max_epoches
 
     param_groups = model.get_parameter_groups()
@@ -83,14 +89,14 @@ if __name__ == '__main__':
         assert args.network == "network.resnet38_aff"
         weights_dict = network.resnet38d.convert_mxnet_to_torch(args.weights)
     else:
-        weights_dict = torch.load(args.weights)
+        weights_dict = torch.load(args.weights, map_location='cpu')
 
     # Size Mismatch occur!(warning)
     try:
         model.load_state_dict(weights_dict, strict=False)
     except RuntimeError as e:
         print(e)
-    model = torch.nn.DataParallel(model).cuda()
+    model = torchutils.data_parallel(model, device)
     model.train()
 
     avg_meter = pyutils.AverageMeter('loss', 'bg_loss', 'fg_loss', 'neg_loss', 'bg_cnt',
@@ -102,11 +108,11 @@ if __name__ == '__main__':
 
         for iter, pack in enumerate(train_data_loader):
 
-            aff = model.forward(pack[0])
+            aff = model.forward(pack[0].to(device, non_blocking=True))
 
-            bg_label = pack[1][0].cuda(non_blocking=True)
-            fg_label = pack[1][1].cuda(non_blocking=True)
-            neg_label = pack[1][2].cuda(non_blocking=True)
+            bg_label = pack[1][0].to(device, non_blocking=True)
+            fg_label = pack[1][1].to(device, non_blocking=True)
+            neg_label = pack[1][2].to(device, non_blocking=True)
 
             bg_count = torch.sum(bg_label) + 1e-5
             fg_count = torch.sum(fg_label) + 1e-5
@@ -145,4 +151,4 @@ if __name__ == '__main__':
             print('')
             timer.reset_stage()
 
-    torch.save(model.module.state_dict(), os.path.join('result', args.session_name, 'aff.pth'))
+    torch.save(getattr(model, 'module', model).state_dict(), os.path.join('result', args.session_name, 'aff.pth'))
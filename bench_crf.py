@@ -0,0 +1,104 @@
+import os
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+import voc12.data
+from tool import crf
+
+
+def confusion(pred, gt, num_cls=21):
+    mask = gt < num_cls
+    return np.bincount(num_cls * gt[mask].astype(np.int64) + pred[mask], minlength=num_cls ** 2).reshape(num_cls, num_cls)
+
+
+def miou(mat):
+    tp = np.diag(mat).astype(np.float64)
+    union = mat.sum(0) + mat.sum(1) - tp
+    return np.mean(tp[union > 0] / union[union > 0])
+
+
+def torch_crf_map(model, jobs, device, n_labels=21, gt_prob=0.7):
+    # MeanFieldCRF label maps of the jobs of CRFPool.map, one image at a time on device
+    preds = []
+    for job in jobs:
+        img = torch.from_numpy(job['img']).permute(2, 0, 1).unsqueeze(0).to(device)
+        if 'labels' in job:
+            probs = crf.probs_from_labels(torch.from_numpy(job['labels']).unsqueeze(0).to(device), n_labels, gt_prob)
+        else:
+            probs = torch.from_numpy(job['probs']).unsqueeze(0).to(device)
+        preds.append(torch.argmax(model(probs, img)[0], dim=0).to(torch.uint8).cpu().numpy())
+    return preds
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--infer_list", default="voc12/train.txt", type=str)
+    parser.add_argument("--voc12_root", default='VOC2012', type=str)
+    parser.add_argument("--cam_dir", required=True, type=str)  # cam npy dicts of contrast_infer.py --out_cam
+    parser.add_argument("--num_images", default=100, type=int)
+    parser.add_argument("--scale_factors", default=[1, 2, 4], nargs='+', type=float)
+    parser.add_argument("--num_workers", default=8, type=int)
+    parser.add_argument("--crf_iters", default=10, type=int)
+    parser.add_argument("--params", default='cam', choices=list(crf.CRF_PARAMS.keys()), type=str)
+    parser.add_argument("--unary", default='labels', choices=['labels', 'probs'], type=str)
+    parser.add_argument("--alpha", default=4, type=float)  # background score (1 - max cam) ** alpha, as aff_prepare.py
+    parser.add_argument("--backends", default=['densecrf', 'torch'], nargs='+', choices=['densecrf', 'torch'], type=str)
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu', type=str)  # torch backend
+
+    args = parser.parse_args()
+
+    name_list = voc12.data.load_img_name_list(args.infer_list)[:args.num_images]
+    jobs, gts = [], []
+    for name in name_list:
+        cam_dict = np.load(os.path.join(args.cam_dir, name + '.npy'), allow_pickle=True).item()
+        h, w = list(cam_dict.values())[0].shape
+        tensor = np.zeros((21, h, w), np.float32)
+        for key in cam_dict.keys():
+            tensor[key + 1] = cam_dict[key]
+        tensor[0] = np.power(1 - np.max(tensor, axis=0), args.alpha)
+        img = np.array(Image.open(voc12.data.get_img_path(name, args.voc12_root)).convert('RGB'))
+        if args.unary == 'labels':
+            jobs.append(dict(img=img, labels=np.argmax(tensor, axis=0).astype(np.uint8)))
+        else:
+            jobs.append(dict(img=img, probs=tensor / np.maximum(tensor.sum(0, keepdims=True), 1e-5)))
+        gt_file = os.path.join(args.voc12_root, 'SegmentationClass', name + '.png')
+        gts.append(np.array(Image.open(gt_file)) if os.path.exists(gt_file) else None)
+
+    print('%d images, %s CRF, %d iterations, unary from %s' % (len(jobs), args.params, args.crf_iters, args.unary))
+    # the torch backend runs one image at a time on --device, it has no pool throughput
+    print('%9s %6s %12s %14s %15s %12s' % ('backend', 'scale', 'ms/img (1p)', 'ms/img (%dp)' % args.num_workers,
+                                           'mIoU vs %s x%g' % (args.backends[0], args.scale_factors[0]), 'mIoU vs gt'))
+    reference = None
+    for backend in args.backends:
+        for scale_factor in args.scale_factors:
+            if backend == 'densecrf':
+                kwargs = dict(argmax=True, t=args.crf_iters, scale_factor=scale_factor, **crf.CRF_PARAMS[args.params])
+
+                # latency in a single process, throughput of the pool
+                with crf.CRFPool(0, **kwargs) as pool:
+                    start = time.time()
+                    preds = pool.map(jobs)
+                    latency = (time.time() - start) * 1000 / len(jobs)
+                with crf.CRFPool(args.num_workers, **kwargs) as pool:
+                    start = time.time()
+                    pool.map(jobs)
+                    throughput = '%14.1f' % ((time.time() - start) * 1000 / len(jobs))
+            else:
+                model = crf.MeanFieldCRF(args.crf_iters, scale_factor, **crf.CRF_PARAMS[args.params])
+                torch_crf_map(model, jobs[:1], args.device)  # warm up
+                start = time.time()
+                preds = torch_crf_map(model, jobs, args.device)
+                latency = (time.time() - start) * 1000 / len(jobs)
+                throughput = '%14s' % '-'
+
+            if reference is None:
+                reference = preds
+            agreement = miou(sum(confusion(p, r) for p, r in zip(preds, reference)))
+            if all(gt is not None for gt in gts):
+                score = '%12.2f' % (miou(sum(confusion(p, gt) for p, gt in zip(preds, gts))) * 100)
+            else:
+                score = '%12s' % '-'
+            print('%9s %6.2f %12.1f %s %15.2f %s' % (backend, scale_factor, latency, throughput, agreement * 100, score))
@@ -4,14 +4,11 @@ import numpy as np
 import torch
 import voc12.data
 import importlib
-import imageio
 import torchvision
 import torch.nn.functional as F
-import pydensecrf.densecrf as dcrf
 from PIL import Image
 from torch.utils.data import DataLoader
-from tool import imutils, pyutils
-from pydensecrf.utils import unary_from_labels, create_pairwise_bilateral, create_pairwise_gaussian
+from tool import imutils, pyutils, torchutils, crf
 from tqdm import tqdm
 
 if __name__ == '__main__':
@@ -27,24 +24,61 @@ if __name__ == '__main__':
     parser.add_argument("--out_cam_pred", default=None, type=str)  # cam_png
     parser.add_argument("--out_cam_pred_alpha", default=0.26, type=float)  # cam_png_bg_score
     parser.add_argument("--crf_iters", default=10, type=float)
+    parser.add_argument("--crf_workers", default=0, type=int)  # CRF processes, 0: CRF in the main loop
+    parser.add_argument("--crf_scale", default=1, type=float)  # > 1: CRF on the image downsampled by this factor
+    parser.add_argument("--crf_backend", default='densecrf', choices=['densecrf', 'torch'], type=str)  # torch: on --device
+    parser.add_argument("--pcm_max_mb", default=0, type=float)  # PCM affinity block size in MB, 0: full matrix
+    parser.add_argument("--device", default=None, type=str)  # cpu / cuda / cuda:N, default: cuda if available
+    parser.add_argument("--num_threads", default=0, type=int)  # cpu intra-op threads, 0: torch default
+    parser.add_argument("--num_interop_threads", default=0, type=int)
+    parser.add_argument("--bf16", action='store_true')  # bf16 autocast where supported
+    parser.add_argument("--uint8", action='store_true')  # ship uint8 images, normalize on the device
+    parser.add_argument("--num_writers", default=4, type=int)  # background threads writing npy / png results
+    parser.add_argument("--png_compression", default=None, type=int)  # 0-9, lower is faster and larger
 
     args = parser.parse_args()
+
+    crf_torch = None
+    if args.crf_backend == 'torch':
+        crf_torch = crf.MeanFieldCRF(int(args.crf_iters), args.crf_scale, **crf.CRF_PARAMS['label'])
+        args.crf_workers = 0
+
+    # forked before any cuda / thread state exists
+    crf_pool = crf.CRFPool(args.crf_workers, argmax=True, t=int(args.crf_iters), scale_factor=args.crf_scale,
+                           **crf.CRF_PARAMS['label'])
+
+    device = torchutils.get_device(args.device, args.num_threads, args.num_interop_threads)
+    if args.bf16 and not torchutils.bf16_supported(device):
+        print('bf16 is not supported on %s, running in fp32' % device)
+        args.bf16 = False
+
     model = getattr(importlib.import_module(args.network), 'Net')()
-    model.load_state_dict(torch.load(args.weights))
+    model.pcm_max_mb = args.pcm_max_mb
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'))
 
     model.eval()
-    model.cuda()
+    model.to(device)
 
     infer_dataset = voc12.data.VOC12ClsDatasetMSF(args.infer_list, voc12_root=args.voc12_root,
                                                   scales=[0.5, 1.0, 1.5, 2.0],
                                                   inter_transform=torchvision.transforms.Compose(
-                                                      [np.asarray,
-                                                       model.normalize,
-                                                       imutils.HWC_to_CHW]))
-    infer_data_loader = DataLoader(infer_dataset, shuffle=False, num_workers=args.num_workers, pin_memory=True)
-
-    n_gpus = torch.cuda.device_count()
-    model_replicas = torch.nn.parallel.replicate(model, list(range(n_gpus)))
+                                                      [np.asarray] +
+                                                      ([] if args.uint8 else [model.normalize]) +
+                                                      [imutils.HWC_to_CHW]))
+    infer_data_loader = DataLoader(infer_dataset, shuffle=False, num_workers=args.num_workers,
+                                   pin_memory=device.type == 'cuda')
+
+    # a bare 'cuda' device spreads the scales over all visible GPUs
+    if device.type == 'cuda' and device.index is None:
+        devices = [torch.device('cuda', i) for i in range(torch.cuda.device_count())]
+        model_replicas = torch.nn.parallel.replicate(model, devices)
+    else:
+        devices = [device]
+        model_replicas = [model]
+    n_replicas = len(devices)
+
+    writer = pyutils.AsyncWriter(num_threads=args.num_writers, max_queue=4 * args.num_writers,
+                                 png_compression=args.png_compression)
 
     for iter, (img_name, img_list, label) in tqdm(enumerate(infer_data_loader), total=len(infer_data_loader)):
         img_name = img_name[0]
@@ -57,9 +91,11 @@ if __name__ == '__main__':
 
         def _work(i, img):
             with torch.no_grad():
-                with torch.cuda.device(i % n_gpus):
-                    _, cam, f, ff = model_replicas[i % n_gpus](img.cuda())
-                    cam = F.upsample(cam[:, 1:, :, :], orig_img_size, mode='bilinear', align_corners=False)[0]
+                with torchutils.autocast(devices[i % n_replicas], args.bf16):
+                    img = torchutils.normalize_batch(img.to(devices[i % n_replicas]),
+                                                     model.normalize.mean, model.normalize.std)
+                    _, cam, f, ff = model_replicas[i % n_replicas](img)
+                    cam = F.upsample(cam[:, 1:, :, :].float(), orig_img_size, mode='bilinear', align_corners=False)[0]
                     cam = cam.cpu().numpy() * label.clone().view(20, 1, 1).numpy()
                     if i % 2 == 1:
                         cam = np.flip(cam, axis=-1)
@@ -87,7 +123,7 @@ if __name__ == '__main__':
         if args.out_cam is not None:
             if not os.path.exists(args.out_cam):
                 os.makedirs(args.out_cam)
-            np.save(os.path.join(args.out_cam, img_name + '.npy'), cam_dict)
+            writer.save_npy(os.path.join(args.out_cam, img_name + '.npy'), cam_dict)
 
         if args.out_cam_pred is not None:
 
@@ -96,7 +132,7 @@ if __name__ == '__main__':
 
             bg_score = [np.ones_like(norm_cam[0]) * args.out_cam_pred_alpha]
             pred = np.argmax(np.concatenate((bg_score, norm_cam)), 0)
-            imageio.imsave(os.path.join(args.out_cam_pred, img_name + '.png'), pred.astype(np.uint8))
+            writer.imwrite(os.path.join(args.out_cam_pred, img_name + '.png'), pred.astype(np.uint8))
 
 
         def _crf(cam_dict, bg_score=0.26):
@@ -109,21 +145,16 @@ if __name__ == '__main__':
             predict = np.argmax(tensor, axis=0).astype(np.uint8)
             img = Image.open(os.path.join(args.voc12_root, 'JPEGImages', img_name + '.jpg')).convert("RGB")
             img = np.array(img)
-            crf_score = _crf_inference(img, predict)
-            return np.argmax(crf_score, axis=0).astype(np.uint8)
+            if crf_torch is not None:
+                # the label map, computed on the inference device
+                probs = crf.probs_from_labels(torch.from_numpy(predict).unsqueeze(0).to(device), 21, gt_prob=0.7)
+                Q = crf_torch(probs, torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).to(device))
+                return torch.argmax(Q[0], dim=0).to(torch.uint8).cpu().numpy()
+            return crf_pool.submit(img, labels=predict)
 
-        def _crf_inference(img, labels, t=10, n_labels=21, gt_prob=0.7):
-
-            h, w = img.shape[:2]
-            d = dcrf.DenseCRF2D(w, h, n_labels)
-            unary = unary_from_labels(labels, n_labels, gt_prob=gt_prob, zero_unsure=False)
-            d.setUnaryEnergy(unary)
-            d.addPairwiseGaussian(sxy=3, compat=3)
-            d.addPairwiseBilateral(sxy=50, srgb=5, rgbim=np.ascontiguousarray(np.copy(img)), compat=10)
-
-            q = d.inference(t)
-
-            return np.array(q).reshape((n_labels, h, w))
+        def _write_crf(file_path, crf_result):
+            # runs on a writer thread, waits for the CRF process
+            writer.write_image(file_path, crf_result.get())
 
 
         if args.out_crf is not None:
@@ -131,4 +162,10 @@ if __name__ == '__main__':
             folder = args.out_crf
             if not os.path.exists(folder):
                 os.makedirs(folder)
-            imageio.imsave(os.path.join(folder, img_name + '.png'), crf_pred.astype(np.uint8))
+            if crf_torch is not None:
+                writer.imwrite(os.path.join(folder, img_name + '.png'), crf_pred)
+            else:
+                writer.submit(_write_crf, os.path.join(folder, img_name + '.png'), crf_pred)
+
+    writer.close()
+    crf_pool.close()
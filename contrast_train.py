@@ -49,6 +49,13 @@ if __name__ == '__main__':
     parser.add_argument("--voc12_root", default='VOC2012', type=str)
     parser.add_argument("--tblog_dir", default='./tblog', type=str)
     parser.add_argument("--bg_threshold", default=0.20, type=float)
+    parser.add_argument("--pcm_max_mb", default=0, type=float)  # PCM affinity block size in MB, 0: full matrix
+    parser.add_argument("--joint_views", action='store_true')  # both views in one forward, view 2 made by the loader
+    parser.add_argument("--gpu_aug", action='store_true')  # workers only resize and crop uint8, jitter/flip/normalize on device
+    parser.add_argument("--fast_jitter", action='store_true')  # imutils.ColorJitter (cv2 LUTs) instead of torchvision's
+    parser.add_argument("--device", default=None, type=str)  # cpu / cuda / cuda:N, default: cuda if available
+    parser.add_argument("--num_threads", default=0, type=int)  # cpu intra-op threads, 0: torch default
+    parser.add_argument("--num_interop_threads", default=0, type=int)
     # parser.add_argument("--saved_dir", default='VOC2012', type=str)
 
     args = parser.parse_args()
@@ -57,22 +64,36 @@ if __name__ == '__main__':
 
     print(vars(args))
 
+    device = torchutils.get_device(args.device, args.num_threads, args.num_interop_threads)
+
     model = getattr(importlib.import_module(args.network), 'Net')()
+    model.pcm_max_mb = args.pcm_max_mb
 
     tblogger = SummaryWriter(args.tblog_dir)
 
+    if args.gpu_aug:
+        train_transform = transforms.Compose([
+            imutils.RandomResizeLong(448, 768),
+            np.asarray,
+            imutils.RandomCropBox(args.crop_size)
+        ])
+        batch_augment = torchutils.BatchAugment(model.normalize.mean, model.normalize.std,
+                                                brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1)
+    else:
+        train_transform = transforms.Compose([
+            imutils.RandomResizeLong(448, 768),
+            transforms.RandomHorizontalFlip(),
+            (imutils.ColorJitter if args.fast_jitter else transforms.ColorJitter)(brightness=0.3, contrast=0.3,
+                                                                                  saturation=0.3, hue=0.1),
+            np.asarray,
+            model.normalize,
+            imutils.RandomCrop(args.crop_size),
+            imutils.HWC_to_CHW,
+            torch.from_numpy
+        ] + ([torchutils.RescaledView((128, 128))] if args.joint_views else []))
+
     train_dataset = voc12.data.VOC12ClsDataset(args.train_list, voc12_root=args.voc12_root,
-                                               transform=transforms.Compose([
-                                                   imutils.RandomResizeLong(448, 768),
-                                                   transforms.RandomHorizontalFlip(),
-                                                   transforms.ColorJitter(brightness=0.3, contrast=0.3,
-                                                                          saturation=0.3, hue=0.1),
-                                                   np.asarray,
-                                                   model.normalize,
-                                                   imutils.RandomCrop(args.crop_size),
-                                                   imutils.HWC_to_CHW,
-                                                   torch.from_numpy
-                                               ]))
+                                               transform=train_transform)
 
     def worker_init_fn(worker_id):
         np.random.seed(1 + worker_id)
@@ -81,7 +102,7 @@ if __name__ == '__main__':
                                    batch_size=args.batch_size,
                                    shuffle=True,
                                    num_workers=args.num_workers,
-                                   pin_memory=True,
+                                   pin_memory=device.type == 'cuda',
                                    drop_last=True,
                                    worker_init_fn=worker_init_fn)
 
@@ -101,11 +122,14 @@ if __name__ == '__main__':
         assert 'resnet38' in args.network
         weights_dict = network.resnet38d.convert_mxnet_to_torch(args.weights)
     else:
-        weights_dict = torch.load(args.weights)
+        weights_dict = torch.load(args.weights, map_location='cpu')
 
     model.load_state_dict(weights_dict, strict=False)
 
-    model = torch.nn.DataParallel(model).cuda()
+    net = model
+    if args.joint_views:
+        model = torchutils.MultiViewForward(model)
+    model = torchutils.data_parallel(model, device)
     model.train()
 
     avg_meter = pyutils.AverageMeter('loss',
@@ -120,25 +144,40 @@ if __name__ == '__main__':
     timer = pyutils.Timer("Session started: ")
 
     # Prototype
-    PROTO1 = F.normalize(torch.rand(21, 128).cuda(), p=2, dim=1)
-    PROTO2 = F.normalize(torch.rand(21, 128).cuda(), p=2, dim=1)
+    PROTO1 = F.normalize(torch.rand(21, 128, device=device), p=2, dim=1)
+    PROTO2 = F.normalize(torch.rand(21, 128, device=device), p=2, dim=1)
 
     for ep in range(args.max_epoches):
 
         for iter, pack in enumerate(train_data_loader):
             # scale_factor = 0.3
-            img1 = pack[1]
-            img2 = F.interpolate(img1,
-                                 size=(128, 128),
-                                 mode='bilinear',
-                                 align_corners=True)
+            if args.gpu_aug:
+                img1 = batch_augment(pack[1][0].to(device, non_blocking=True), pack[1][1])
+                img2 = F.interpolate(img1,
+                                     size=(128, 128),
+                                     mode='bilinear',
+                                     align_corners=True)
+            elif args.joint_views:
+                img1 = pack[1][0].to(device, non_blocking=True)
+                img2 = pack[1][1].to(device, non_blocking=True)
+            else:
+                img1 = pack[1].to(device, non_blocking=True)
+                img2 = F.interpolate(img1,
+                                     size=(128, 128),
+                                     mode='bilinear',
+                                     align_corners=True)
             N, C, H, W = img1.size()
             label = pack[2]
 
             bg_score = torch.ones((N, 1))
             label = torch.cat((bg_score, label), dim=1)
-            label = label.cuda(non_blocking=True).unsqueeze(2).unsqueeze(3)
-            cam1, cam_rv1, f_proj1, cam_rv1_down = model(img1)
+            label = label.to(device, non_blocking=True).unsqueeze(2).unsqueeze(3)
+            if args.joint_views:
+                out1, out2 = model(img1, img2)
+            else:
+                out1, out2 = model(img1), model(img2)
+
+            cam1, cam_rv1, f_proj1, cam_rv1_down = out1
             label1 = F.adaptive_avg_pool2d(cam1, (1, 1))
             loss_rvmin1 = adaptive_min_pooling_loss((cam_rv1 * label)[:, 1:, :, :])
 
@@ -151,7 +190,7 @@ if __name__ == '__main__':
                                     mode='bilinear',
                                     align_corners=True) * label
 
-            cam2, cam_rv2, f_proj2, cam_rv2_down = model(img2)
+            cam2, cam_rv2, f_proj2, cam_rv2_down = out2
             label2 = F.adaptive_avg_pool2d(cam2, (1, 1))
             loss_rvmin2 = adaptive_min_pooling_loss((cam_rv2 * label)[:, 1:, :, :])
             cam2 = visualization.max_norm(cam2) * label
@@ -201,7 +240,7 @@ if __name__ == '__main__':
 
                 top_values, top_indices = torch.topk(cam_rv1_down.transpose(0, 1).reshape(c_sc1, -1),
                                                      k=h_sc1 * w_sc1 // 8, dim=-1)
-                prototypes1 = torch.zeros(c_sc1, c_fea1).cuda()  # [21, 128]
+                prototypes1 = torch.zeros(c_sc1, c_fea1, device=device)  # [21, 128]
                 for i in range(c_sc1):
                     top_fea = fea1[top_indices[i]]
                     prototypes1[i] = torch.sum(top_values[i].unsqueeze(-1) * top_fea, dim=0) / torch.sum(top_values[i])
@@ -230,7 +269,7 @@ if __name__ == '__main__':
                 fea2 = fea2.permute(0, 2, 3, 1).reshape(-1, c_fea2)
                 top_values2, top_indices2 = torch.topk(cam_rv2_down.transpose(0, 1).reshape(c_sc2, -1),
                                                        k=h_sc2 * w_sc2 // 8, dim=-1)
-                prototypes2 = torch.zeros(c_sc2, c_fea2).cuda()
+                prototypes2 = torch.zeros(c_sc2, c_fea2, device=device)
 
                 for i in range(c_sc2):
                     top_fea2 = fea2[top_indices2[i]]
@@ -297,7 +336,7 @@ if __name__ == '__main__':
             lower_negitives_intra1 = negitives_intra1[torch.arange(n_f * h_f * w_f).unsqueeze(1), lower_indices]
             negitives_intra1 = torch.cat([positives_intra1.unsqueeze(1), lower_negitives_intra1], dim=1)
             A2_intra_view1 = torch.sum(torch.exp(torch.matmul(f_proj1.unsqueeze(1), negitives_intra1.transpose(1, 2)).squeeze(1) / 0.1), dim=-1)
-            loss_intra_nce1 = torch.zeros(1).cuda()
+            loss_intra_nce1 = torch.zeros(1, device=device)
             C = 0
             exists = np.unique(pseudo_label1.cpu().numpy()).tolist()
             # hard pixel sampling
@@ -350,7 +389,7 @@ if __name__ == '__main__':
             lower_negitives_intra2 = negitives_intra2[torch.arange(n_f * w_f * h_f).unsqueeze(1), lower_indices]
             negitives_intra2 = torch.cat([positives_intra2.unsqueeze(1), lower_negitives_intra2], dim=1)
             A4_intra_view2 = torch.sum(torch.exp(torch.matmul(f_proj2.unsqueeze(1), negitives_intra2.transpose(1, 2)).squeeze(1) / 0.1), dim=-1)
-            loss_intra_nce2 = torch.zeros(1).cuda()
+            loss_intra_nce2 = torch.zeros(1, device=device)
             C = 0
             exists = np.unique(pseudo_label2.cpu().numpy()).tolist()
             # hard pixel sampling
@@ -438,4 +477,4 @@ if __name__ == '__main__':
             timer.reset_stage()
     print(args.session_name)
 
-    torch.save(model.module.state_dict(), os.path.join('result', args.session_name, 'contrast.pth'))
+    torch.save(net.state_dict(), os.path.join('result', args.session_name, 'contrast.pth'))
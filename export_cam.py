@@ -0,0 +1,78 @@
+import time
+import argparse
+import importlib
+import numpy as np
+import torch
+from tool import torchutils
+
+
+def benchmark(model, x, num_iters, warmup):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+
+        times = []
+        for _ in range(num_iters):
+            start = time.time()
+            model(x)
+            if x.is_cuda:
+                torch.cuda.synchronize(x.device)
+            times.append(time.time() - start)
+
+    return np.median(times) * 1000, np.mean(times) * 1000
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", required=True, type=str)
+    parser.add_argument("--network", default="network.resnet38_contrast", type=str)
+    parser.add_argument("--mode", default='trace', choices=['trace', 'compile'], type=str)
+    parser.add_argument("--out", default=None, type=str)  # TorchScript file, trace mode only
+    parser.add_argument("--height", default=448, type=int)
+    parser.add_argument("--width", default=448, type=int)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--freeze", action='store_true')  # fold BN/constants into the traced graph
+    parser.add_argument("--benchmark", action='store_true')  # eager vs exported latency
+    parser.add_argument("--num_iters", default=20, type=int)
+    parser.add_argument("--warmup", default=3, type=int)
+    parser.add_argument("--device", default='cpu', type=str)
+    parser.add_argument("--num_threads", default=0, type=int)
+    parser.add_argument("--num_interop_threads", default=0, type=int)
+
+    args = parser.parse_args()
+    print(vars(args))
+
+    device = torchutils.get_device(args.device, args.num_threads, args.num_interop_threads)
+
+    net = getattr(importlib.import_module(args.network), 'Net')()
+    net.load_state_dict(torch.load(args.weights, map_location='cpu'))
+
+    model = getattr(importlib.import_module(args.network), 'CAMNet')(net)
+    model.eval()
+    model.to(device)
+
+    x = torch.randn(args.batch_size, 3, args.height, args.width, device=device)
+
+    with torch.no_grad():
+        if args.mode == 'trace':
+            exported = torch.jit.trace(model, x)
+            if args.freeze:
+                exported = torch.jit.freeze(exported)
+            if args.out is not None:
+                exported.save(args.out)
+                print('saved traced CAM model to %s' % args.out)
+        else:
+            # a compiled module lives in this process only, it can not be saved
+            exported = torch.compile(model)
+            if args.out is not None:
+                print('--out is ignored in compile mode')
+
+        diff = (exported(x) - model(x)).abs().max().item()
+    print('max abs diff eager vs %s: %g' % (args.mode, diff))
+
+    if args.benchmark:
+        for name, m in [('eager', model), (args.mode, exported)]:
+            median, mean = benchmark(m, x, args.num_iters, args.warmup)
+            print('%7s: %8.2fms median, %8.2fms mean (%d x 3 x %d x %d, %s, %d threads)'
+                  % (name, median, mean, args.batch_size, args.height, args.width, device, torch.get_num_threads()))
@@ -7,7 +7,7 @@ import numpy as np
 np.set_printoptions(threshold=np.inf)
 
 import network.resnet38d
-from tool import pyutils
+from tool import pyutils, torchutils
 
 
 class Net(network.resnet38d.Net):
@@ -27,6 +27,9 @@ class Net(network.resnet38d.Net):
         self.from_scratch_layers = [self.f8_3, self.f8_4, self.f9, self.fc8]
         self.not_training = [self.conv1a, self.b2, self.b2_1, self.b2_2]
 
+        # > 0: compute the PCM affinity in column blocks of at most this many MB
+        self.pcm_max_mb = 0
+
     def forward(self, x):
         N, C, H, W = x.size()
         d = super().forward_as_dict(x)
@@ -60,9 +63,7 @@ class Net(network.resnet38d.Net):
         f = f.view(n, -1, h * w)
         # norm
         f = f / (torch.norm(f, dim=1, keepdim=True) + 1e-5)
-        aff = F.relu(torch.matmul(f.transpose(1, 2), f), inplace=True)
-        aff = aff / (torch.sum(aff, dim=1, keepdim=True) + 1e-5)
-        cam_rv = torch.matmul(cam, aff).view(n, -1, h, w)
+        cam_rv = torchutils.pixel_correlation(cam, f, self.pcm_max_mb).view(n, -1, h, w)
 
         return cam_rv
 
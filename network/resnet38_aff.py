@@ -1,6 +1,5 @@
 import torch
 import torch.nn as nn
-import torch.sparse as sparse
 import torch.nn.functional as F
 
 import network.resnet38d
@@ -32,7 +31,13 @@ class Net(network.resnet38d.Net):
         self.ind_from = torch.from_numpy(self.ind_from); self.ind_to = torch.from_numpy(self.ind_to)
         return
 
-    def forward(self, x, to_dense=False):
+    def forward(self, x, to_dense=False, to_sparse=False):
+
+        x = self.forward_feature(x)
+
+        return self.forward_aff(x, to_dense, to_sparse)
+
+    def forward_feature(self, x):
 
         d = super().forward_as_dict(x)
 
@@ -41,6 +46,10 @@ class Net(network.resnet38d.Net):
         f8_5 = F.elu(self.f8_5(d['conv6']))
         x = F.elu(self.f9(torch.cat([f8_3, f8_4, f8_5], dim=1)))
 
+        return x
+
+    def forward_aff(self, x, to_dense=False, to_sparse=False):
+
         if x.size(2) == self.predefined_featuresize and x.size(3) == self.predefined_featuresize:
             ind_from = self.ind_from
             ind_to = self.ind_to
@@ -51,31 +60,36 @@ class Net(network.resnet38d.Net):
             ind_from = torch.from_numpy(ind_from); ind_to = torch.from_numpy(ind_to)
 
         x = x.view(x.size(0), x.size(1), -1).contiguous()
-        ind_from = ind_from.contiguous()
-        ind_to = ind_to.contiguous()
+        ind_from = ind_from.contiguous().to(x.device, non_blocking=True)
+        ind_to = ind_to.contiguous().to(x.device, non_blocking=True)
 
-        ff = torch.index_select(x, dim=2, index=ind_from.cuda(non_blocking=True))
-        ft = torch.index_select(x, dim=2, index=ind_to.cuda(non_blocking=True))
+        ff = torch.index_select(x, dim=2, index=ind_from)
+        ft = torch.index_select(x, dim=2, index=ind_to)
 
         ff = torch.unsqueeze(ff, dim=2)
         ft = ft.view(ft.size(0), ft.size(1), -1, ff.size(3))
 
         aff = torch.exp(-torch.mean(torch.abs(ft-ff), dim=1))
 
-        if to_dense:
-            aff = aff.view(-1).cpu()
+        if to_dense or to_sparse:
+            # the symmetric affinity matrix is assembled on the device of the features
+            aff = aff.view(-1)
 
             ind_from_exp = torch.unsqueeze(ind_from, dim=0).expand(ft.size(2), -1).contiguous().view(-1)
             indices = torch.stack([ind_from_exp, ind_to])
             indices_tp = torch.stack([ind_to, ind_from_exp])
 
             area = x.size(2)
-            indices_id = torch.stack([torch.arange(0, area).long(), torch.arange(0, area).long()])
+            indices_id = torch.arange(0, area, device=x.device).long().unsqueeze(0).expand(2, -1)
+
+            aff_mat = torch.sparse_coo_tensor(torch.cat([indices, indices_id, indices_tp], dim=1),
+                                              torch.cat([aff, torch.ones([area], device=x.device), aff]),
+                                              (area, area))
 
-            aff_mat = sparse.FloatTensor(torch.cat([indices, indices_id, indices_tp], dim=1),
-                                      torch.cat([aff, torch.ones([area]), aff])).to_dense().cuda()
+            if to_sparse:
+                return aff_mat.coalesce()
 
-            return aff_mat
+            return aff_mat.to_dense()
 
         else:
             return aff
@@ -6,7 +6,7 @@ import numpy as np
 np.set_printoptions(threshold=np.inf)
 
 import network.resnet38d
-from tool import pyutils
+from tool import pyutils, torchutils
 
 class Net(network.resnet38d.Net):
     def __init__(self):
@@ -28,6 +28,9 @@ class Net(network.resnet38d.Net):
         self.from_scratch_layers = [self.f8_3, self.f8_4, self.f9, self.fc8, self.fc_proj]
         self.not_training = [self.conv1a, self.b2, self.b2_1, self.b2_2]
 
+        # > 0: compute the PCM affinity in column blocks of at most this many MB
+        self.pcm_max_mb = 0
+
     def forward(self, x):
         N, C, H, W = x.size()
         d = super().forward_as_dict(x)
@@ -60,6 +63,30 @@ class Net(network.resnet38d.Net):
 
         return cam, cam_rv, f_proj, cam_rv_down
 
+    def forward_cam(self, x):
+        # inference-only path of forward(): no projection head, no in-place ops
+        N, C, H, W = x.size()
+        d = super().forward_as_dict(x)
+
+        cam = self.fc8(d['conv6'])
+        n, c, h, w = cam.size()
+
+        cam_d = F.relu(cam)
+        cam_d_max = torch.max(cam_d.view(n, c, -1), dim=-1)[0].view(n, c, 1, 1) + 1e-5
+        cam_d_norm = F.relu(cam_d - 1e-5) / cam_d_max
+        cam_fg = cam_d_norm[:, 1:, :, :]
+        cam_max = torch.max(cam_fg, dim=1, keepdim=True)[0]
+        cam_d_norm = torch.cat([1 - cam_max, cam_fg * (cam_fg >= cam_max).to(cam_fg.dtype)], dim=1)
+
+        f8_3 = F.relu(self.f8_3(d['conv4']))
+        f8_4 = F.relu(self.f8_4(d['conv5']))
+        x_s = F.interpolate(x, (h, w), mode='bilinear', align_corners=True)
+        f = torch.cat([x_s, f8_3, f8_4], dim=1)
+
+        cam_rv = self.PCM(cam_d_norm, f)
+
+        return F.interpolate(cam_rv, (H, W), mode='bilinear', align_corners=True)
+
     def PCM(self, cam, f):
 
         n,c,h,w = f.size()
@@ -68,9 +95,7 @@ class Net(network.resnet38d.Net):
         f = f.view(n, -1, h*w)
         # norm
         f = f / (torch.norm(f, dim=1, keepdim=True) + 1e-5)
-        aff = F.relu(torch.matmul(f.transpose(1, 2), f), inplace=True)
-        aff = aff/(torch.sum(aff, dim=1, keepdim=True) + 1e-5)
-        cam_rv = torch.matmul(cam, aff).view(n, -1, h, w)
+        cam_rv = torchutils.pixel_correlation(cam, f, self.pcm_max_mb).view(n, -1, h, w)
 
         return cam_rv
 
@@ -95,3 +120,14 @@ class Net(network.resnet38d.Net):
 
         return groups
 
+
+
+class CAMNet(nn.Module):
+    """Wraps a trained Net so that forward() returns only the PCM refined CAM (N x 21 x H x W),
+    which is what contrast_infer uses. Meant for tracing / torch.compile, see export_cam.py."""
+    def __init__(self, net):
+        super(CAMNet, self).__init__()
+        self.net = net
+
+    def forward(self, x):
+        return self.net.forward_cam(x)
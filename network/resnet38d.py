@@ -48,9 +48,6 @@ class ResBlock(nn.Module):
 
         return x
 
-    def __call__(self, x, get_x_bn_relu=False):
-        return self.forward(x, get_x_bn_relu=get_x_bn_relu)
-
 class ResBlock_bot(nn.Module):
     def __init__(self, in_channels, out_channels, stride=1, dilation=1, dropout=0.):
         super(ResBlock_bot, self).__init__()
@@ -98,24 +95,37 @@ class ResBlock_bot(nn.Module):
 
         return x
 
-    def __call__(self, x, get_x_bn_relu=False):
-        return self.forward(x, get_x_bn_relu=get_x_bn_relu)
-
 class Normalize():
     def __init__(self, mean = (0.485, 0.456, 0.406), std = (0.229, 0.224, 0.225)):
 
         self.mean = mean
         self.std = std
 
+        # (x / 255 - mean) / std as x * scale + offset
+        self.scale = (1. / (255. * np.array(std))).astype(np.float32)
+        self.offset = (-np.array(mean) / np.array(std)).astype(np.float32)
+        self.row_params = dict()
+
+    def get_row_params(self, width):
+        # scale / offset tiled over a whole image row, so the broadcast runs over rows of
+        # width * 3 values instead of the 3 channels of every pixel
+        if width not in self.row_params:
+            self.row_params[width] = (np.tile(self.scale, width), np.tile(self.offset, width))
+        return self.row_params[width]
+
     def __call__(self, img):
         imgarr = np.asarray(img)
-        proc_img = np.empty_like(imgarr, np.float32)
+        h, w, c = imgarr.shape
+        scale, offset = self.get_row_params(w)
 
-        proc_img[..., 0] = (imgarr[..., 0] / 255. - self.mean[0]) / self.std[0]
-        proc_img[..., 1] = (imgarr[..., 1] / 255. - self.mean[1]) / self.std[1]
-        proc_img[..., 2] = (imgarr[..., 2] / 255. - self.mean[2]) / self.std[2]
+        if imgarr.dtype == np.float32 and imgarr.flags.writeable and imgarr.flags.c_contiguous:
+            proc_img = imgarr.reshape(h, w * c)
+            proc_img *= scale
+        else:
+            proc_img = np.multiply(imgarr.reshape(h, w * c), scale, dtype=np.float32)
+        proc_img += offset
 
-        return proc_img
+        return proc_img.reshape(h, w, c)
 
 class Net(nn.Module):
     def __init__(self):
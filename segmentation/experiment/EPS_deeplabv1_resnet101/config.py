@@ -10,7 +10,8 @@ import time
 
 config_dict = {
 		'EXP_NAME': 'EPS_deeplabv1_resnet101',
-		'GPUS': 1,
+		'GPUS': 1,		# 0 runs on the cpu
+		'CPU_THREADS': 0,	# torch intra-op threads on the cpu, 0: torch default
 
 		'DATA_NAME': 'VOCDataset',
 		'DATA_YEAR': 2012,
@@ -18,13 +19,18 @@ config_dict = {
 		'DATA_WORKERS': 4,
 		'DATA_MEAN': [0.485, 0.456, 0.406],
 		'DATA_STD': [0.229, 0.224, 0.225],
+		'DATA_UINT8': False,
+		'DATA_SAMPLE_KEYS': [],	# derived keys built per sample: 'mask', 'segmentation_onehot', 'category', 'category_copypaste'
 		'DATA_RANDOMCROP': 448,
 		'DATA_RANDOMSCALE': [0.5, 1.5],
 		'DATA_RANDOM_H': 10,
 		'DATA_RANDOM_S': 10,
 		'DATA_RANDOM_V': 10,
 		'DATA_RANDOMFLIP': 0.5,
+		'DATA_FUSED_AUG': False,	# flip + scale + crop in one warp (RandomScaleCropFlip)
 		'DATA_PSEUDO_GT': 'your_pseudo_label_dir',
+		'DATA_SEG_CACHE': None,	# remapped uint8 label pngs written by lib/utils/convert_labels.py
+		'DATA_COCO_INDEX': False,	# COCODataset: mmap-ed annotation index instead of the COCO api object
 
 		'MODEL_NAME': 'deeplabv1',
 		'MODEL_BACKBONE': 'resnet101',
@@ -49,8 +55,16 @@ config_dict = {
 
 		'TEST_MULTISCALE': [0.5, 0.75, 1.0, 1.25, 1.5, 1.75],
 		'TEST_FLIP': True,
+		'TEST_LAZY_MULTISCALE': False,
 		'TEST_CRF': True,
+		'TEST_CRF_WORKERS': 0,		# CRF processes, 0: CRF in the test loop
+		'TEST_CRF_SCALE': 1,		# > 1: CRF on the image downsampled by this factor
+		'TEST_CRF_BACKEND': 'densecrf',	# 'densecrf': pydensecrf, 'torch': MeanFieldCRF on the GPU
+		'TEST_WRITERS': 4,			# background result writer threads, 0: write inline
+		'TEST_PNG_COMPRESSION': None,	# cv2 png compression level 0-9
 		'TEST_BATCHES': 1,
+		'TEST_SHARDS': 1,			# evaluation processes, spread over the gpus (cpu processes if GPUS = 0)
+		'TEST_ONLINE_EVAL': False,	# score predictions in the test loop, no do_python_eval pass
 }
 
 config_dict['ROOT_DIR'] = os.path.abspath(os.path.join(os.path.dirname("__file__"),'..','..'))
@@ -62,3 +76,5 @@ config_dict['LOG_DIR'] = os.path.join(config_dict['ROOT_DIR'],'log',config_dict[
 config_dict['TEST_CKPT'] = os.path.join(config_dict['ROOT_DIR'], 'your_ckpt.pth')
 
 sys.path.insert(0, os.path.join(config_dict['ROOT_DIR'], 'lib'))
+# the repo root, for the packages shared with the root project (tool.crf), after lib: both have a utils package
+sys.path.append(os.path.dirname(config_dict['ROOT_DIR']))
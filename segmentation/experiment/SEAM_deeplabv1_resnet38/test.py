@@ -13,23 +13,27 @@ torch.backends.cudnn.deterministic=True # cudnn
 import torch.nn as nn
 import torch.nn.functional as F
 import torchvision
+import os
 import cv2
 import time
 
 from config import config_dict
 from datasets.generateData import generate_dataset
+from datasets.metric import ConfusionMatrix
 from net.generateNet import generate_net
 import torch.optim as optim
 from net.sync_batchnorm.replicate import patch_replication_callback
 from torch.utils.data import DataLoader
 from utils.configuration import Configuration
 from utils.finalprocess import writelog
-from utils.imutils import img_denorm
-from utils.DenseCRF import dense_crf, dense_crf_from_deeplabv2
-from utils.test_utils import single_gpu_test
+from utils.imutils import img_denorm, img_norm_batch, img_denorm_batch
+from utils.DenseCRF import dense_crf, dense_crf_from_deeplabv2, CRFPool, MeanFieldCRF, CRF_PARAMS
+from utils.test_utils import single_gpu_test, multiscale_flip, shard_device, sharded_test, size_batch_sampler
 from utils.imutils import onehot
 
 cfg = Configuration(config_dict, False)
+# period = 'val'
+period = 'val'
 
 def ClassLogSoftMax(f, category):
 	exp = torch.exp(f)
@@ -38,16 +42,34 @@ def ClassLogSoftMax(f, category):
 	logsoftmax = torch.log(exp_norm)*category
 	return softmax, logsoftmax
 
-def test_net():
-	# period = 'val'
-	period = 'val'
+def online_eval():
+	# TEST_ONLINE_EVAL: score predictions in the test loop against the ground truth
+	# shipped with each sample instead of re-reading all files in do_python_eval
+	return getattr(cfg, 'TEST_ONLINE_EVAL', False) and 'test' not in period
+
+def confusion_file(rank):
+	return os.path.join(cfg.LOG_DIR, 'confusion_%s_%d.npy'%(period, rank))
+
+def test_shard(rank, num_shards):
+	# TEST_CRF_WORKERS: CRF processes, forked before cuda is initialized (0: CRF in the test loop)
+	# TEST_CRF_SCALE: > 1 runs the CRF downsampled by this factor
+	# TEST_CRF_BACKEND: 'densecrf' (pydensecrf) or 'torch' (MeanFieldCRF on the test device, no workers)
+	crf_pool = None
+	crf_torch = None
+	if cfg.TEST_CRF and getattr(cfg, 'TEST_CRF_BACKEND', 'densecrf') == 'torch':
+		crf_torch = MeanFieldCRF(10, getattr(cfg, 'TEST_CRF_SCALE', 1), **CRF_PARAMS['deeplabv2'])
+	elif cfg.TEST_CRF:
+		crf_pool = CRFPool(getattr(cfg, 'TEST_CRF_WORKERS', 0), dense_crf_from_deeplabv2, n_classes=cfg.MODEL_NUM_CLASSES,
+				scale_factor=getattr(cfg, 'TEST_CRF_SCALE', 1))
 	dataset = generate_dataset(cfg, period=period, transform='none')
+	dataset.shard(rank, num_shards)
 	def worker_init_fn(worker_id):
 		np.random.seed(1 + worker_id)
 	dataloader = DataLoader(dataset, 
-				batch_size=1, 
+				batch_sampler=size_batch_sampler(dataset, cfg.TEST_BATCHES),
 				shuffle=False, 
 				num_workers=cfg.DATA_WORKERS,
+				pin_memory=cfg.GPUS > 0,
 				worker_init_fn = worker_init_fn)
 	
 	net = generate_net(cfg, batchnorm=nn.BatchNorm2d)
@@ -59,16 +81,22 @@ def test_net():
 	if cfg.TEST_CKPT is None:
 		raise ValueError('test.py: cfg.MODEL_CKPT can not be empty in test period')
 	print('start loading model %s'%cfg.TEST_CKPT)
-	model_dict = torch.load(cfg.TEST_CKPT)
+	model_dict = torch.load(cfg.TEST_CKPT, map_location='cpu')
 	net.load_state_dict(model_dict, strict=False)
 
-	print('Use %d GPU'%cfg.GPUS)
-	assert torch.cuda.device_count() == cfg.GPUS
-	device = torch.device('cuda')
+	if num_shards > 1:
+		device = shard_device(rank, cfg.GPUS, getattr(cfg, 'CPU_THREADS', 0), num_shards)
+		print('shard %d/%d: %d images on %s'%(rank, num_shards, len(dataset), device))
+	else:
+		print('Use %d GPU'%cfg.GPUS)
+		device = cfg.DEVICE
 	net.to(device)
 	net.eval()
 
 	def prepare_func(sample):	
+		if cfg.TEST_LAZY_MULTISCALE:
+			image = img_norm_batch(sample['image'].to(device), cfg.DATA_MEAN, cfg.DATA_STD)
+			return multiscale_flip(image, cfg.TEST_MULTISCALE, cfg.TEST_FLIP)
 		image_msf = []
 		for rate in cfg.TEST_MULTISCALE:
 			inputs_batched = sample['image_%f'%rate]
@@ -78,7 +106,7 @@ def test_net():
 		return image_msf
 
 	def inference_func(model, img):
-		seg = model(img)
+		seg = model(img_norm_batch(img, cfg.DATA_MEAN, cfg.DATA_STD))
 		return seg
 
 	def collect_func(result_list, sample):
@@ -92,13 +120,16 @@ def test_net():
 		prob_seg = F.softmax(torch.mean(prob_seg, dim=0, keepdim=True),dim=1)[0]
 		
 
-		if cfg.TEST_CRF:
+		if crf_torch is not None:
+			img_batched = img_denorm_batch(sample['image'][0:1], cfg.DATA_MEAN, cfg.DATA_STD).to(prob_seg.device)
+			prob_seg = crf_torch(prob_seg.unsqueeze(0), img_batched)[0]
+		elif cfg.TEST_CRF:
 			prob = prob_seg.cpu().numpy()
 			img_batched = img_denorm(sample['image'][0].cpu().numpy()).astype(np.uint8)
 			# TODO: crf更改
 			# prob = dense_crf(prob, img_batched, n_classes=cfg.MODEL_NUM_CLASSES, n_iters=1)
-			prob = dense_crf_from_deeplabv2(prob, img_batched)
-			prob_seg = torch.from_numpy(prob.astype(np.float32))
+			# the label map, computed by a CRF worker while the next images go through the net
+			return crf_pool.submit(prob, img_batched)
 
 		result = torch.argmax(prob_seg, dim=0, keepdim=False).cpu().numpy()
 		return result
@@ -106,8 +137,27 @@ def test_net():
 	def save_step_func(result_sample):
 		dataset.save_result([result_sample], cfg.MODEL_NAME)
 
-	result_list = single_gpu_test(net, dataloader, prepare_func=prepare_func, inference_func=inference_func, collect_func=collect_func, save_step_func=save_step_func)
-	resultlog = dataset.do_python_eval(cfg.MODEL_NAME)
+	metric = ConfusionMatrix(cfg.MODEL_NUM_CLASSES) if online_eval() else None
+	result_list = single_gpu_test(net, dataloader, prepare_func=prepare_func, inference_func=inference_func, collect_func=collect_func, save_step_func=save_step_func, metric=metric)
+	dataset.flush_results()
+	if crf_pool is not None:
+		crf_pool.close()
+	if metric is not None:
+		metric.save(confusion_file(rank))
+
+def test_net():
+	# TEST_SHARDS > 1: the images are split over TEST_SHARDS processes,
+	# evaluated together once every shard has written its predictions
+	num_shards = getattr(cfg, 'TEST_SHARDS', 1)
+	sharded_test(test_shard, num_shards)
+	dataset = generate_dataset(cfg, period=period, transform='none')
+	if online_eval():
+		metric = ConfusionMatrix(cfg.MODEL_NUM_CLASSES)
+		for rank in range(num_shards):
+			metric.load(confusion_file(rank))
+		resultlog = dataset.do_online_eval(metric)
+	else:
+		resultlog = dataset.do_python_eval(cfg.MODEL_NAME)
 	print('Test finished')
 	writelog(cfg, period, metric=resultlog)
 
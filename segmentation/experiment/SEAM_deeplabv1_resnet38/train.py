@@ -28,7 +28,7 @@ from torch.utils.data import DataLoader
 from net.sync_batchnorm.replicate import patch_replication_callback
 from utils.configuration import Configuration
 from utils.finalprocess import writelog
-from utils.imutils import img_denorm
+from utils.imutils import img_denorm, img_norm_batch
 from net.sync_batchnorm import SynchronizedBatchNorm2d
 from utils.visualization import generate_vis, max_norm
 from tqdm import tqdm
@@ -45,13 +45,13 @@ def train_net():
 				batch_size=cfg.TRAIN_BATCHES, 
 				shuffle=cfg.TRAIN_SHUFFLE, 
 				num_workers=cfg.DATA_WORKERS,
-				pin_memory=True,
+				pin_memory=cfg.GPUS > 0,
 				drop_last=True,
 				worker_init_fn=worker_init_fn)
 	
 	net = generate_net(cfg, batchnorm=nn.BatchNorm2d)
 	if cfg.TRAIN_CKPT:
-		net.load_state_dict(torch.load(cfg.TRAIN_CKPT),strict=True)
+		net.load_state_dict(torch.load(cfg.TRAIN_CKPT, map_location='cpu'),strict=True)
 		print('load pretrained model')
 	if cfg.TRAIN_TBLOG:
 		from tensorboardX import SummaryWriter
@@ -59,7 +59,7 @@ def train_net():
 		tblogger = SummaryWriter(cfg.LOG_DIR)	
 
 	print('Use %d GPU'%cfg.GPUS)
-	device = torch.device(0)
+	device = cfg.DEVICE
 	if cfg.GPUS > 1:
 		net = nn.DataParallel(net)
 		patch_replication_callback(net)
@@ -93,8 +93,8 @@ def train_net():
 				inputs, seg_label = sample['image'], sample['segmentation']
 				n,c,h,w = inputs.size()
 
-				pred1 = net(inputs.to(0))
-				loss = criterion(pred1, seg_label.to(0))
+				pred1 = net(img_norm_batch(inputs.to(device), cfg.DATA_MEAN, cfg.DATA_STD))
+				loss = criterion(pred1, seg_label.to(device))
 				loss.backward()
 				optimizer.step()
 
@@ -90,7 +90,7 @@ class ADE20KDataset(BaseDataset):
 			os.makedirs(folder_path)
 		for sample in result_list:
 			file_path = os.path.join(folder_path, '%s.png'%(sample['name']))
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 			print('%s saved'%(file_path))
  
 	def label2colormap(self, label):
@@ -118,7 +118,7 @@ class ADE20KDataset(BaseDataset):
 
 
 			'''
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 
 	def do_python_eval(self, model_id):
 		folder_path = os.path.join(self.rst_dir,'%s'%model_id)
@@ -15,6 +15,8 @@ from torch.utils.data import Dataset
 from datasets.transform import *
 from utils.imutils import *
 from utils.registry import DATASETS
+# shared with the root project (repo root on sys.path, see the experiment configs)
+from tool.pyutils import AsyncWriter
 
 #@DATASETS.register_module
 class BaseDataset(Dataset):
@@ -27,11 +29,25 @@ class BaseDataset(Dataset):
 			assert self.transform == 'none'
 		self.num_categories = None
 		self.totensor = ToTensor()
+		self.writer = None
 		self.imagenorm = ImageNorm(cfg.DATA_MEAN, cfg.DATA_STD)
+		# DATA_UINT8: images leave the workers as uint8, normalized on device by img_norm_batch
+		self.uint8 = getattr(cfg, 'DATA_UINT8', False)
+		# DATA_SAMPLE_KEYS: derived label keys to build per sample (all of them when unset)
+		self.sample_keys = getattr(cfg, 'DATA_SAMPLE_KEYS', ['mask', 'segmentation_onehot', 'category', 'category_copypaste'])
+		
+		# DATA_FUSED_AUG: flip, scale and crop as one RandomScaleCropFlip resampling
+		self.fused_aug = getattr(cfg, 'DATA_FUSED_AUG', False) and cfg.DATA_RANDOMCROP > 0
 		
 		if self.transform != 'none':
+			if self.fused_aug:
+				# the window is resampled from the uint8 image, mean colour padding is ~0 once normalized
+				self.randomscalecropflip = RandomScaleCropFlip(cfg.DATA_RANDOMSCALE, cfg.DATA_RANDOMCROP,
+						cfg.DATA_RANDOMFLIP, np.round(np.array(cfg.DATA_MEAN)*255))
 			if cfg.DATA_RANDOMCROP > 0:
-				self.randomcrop = RandomCrop(cfg.DATA_RANDOMCROP)
+				# pad with the mean colour, i.e. 0 after normalization
+				image_fill = np.round(np.array(cfg.DATA_MEAN)*255) if self.uint8 else 0
+				self.randomcrop = RandomCrop(cfg.DATA_RANDOMCROP, image_fill)
 			if cfg.DATA_RANDOMSCALE != 1:
 				self.randomscale = RandomScale(cfg.DATA_RANDOMSCALE)
 			if cfg.DATA_RANDOMFLIP > 0:
@@ -39,6 +55,9 @@ class BaseDataset(Dataset):
 			if cfg.DATA_RANDOM_H > 0 or cfg.DATA_RANDOM_S > 0 or cfg.DATA_RANDOM_V > 0:
 				self.randomhsv = RandomHSV(cfg.DATA_RANDOM_H, cfg.DATA_RANDOM_S, cfg.DATA_RANDOM_V)
 		else:
+			# TEST_LAZY_MULTISCALE: only the base image is shipped, the test loop builds the
+			# pyramid on device with utils.test_utils.multiscale_flip
+			self.lazy_multiscale = getattr(cfg, 'TEST_LAZY_MULTISCALE', False)
 			self.multiscale = Multiscale(self.cfg.TEST_MULTISCALE)
 
 
@@ -46,29 +65,33 @@ class BaseDataset(Dataset):
 		sample = self.__sample_generate__(idx)
 
 		if 'segmentation' in sample.keys():
-			sample['mask'] = sample['segmentation'] < self.num_categories
-			t = sample['segmentation'].copy()
-			t[t >= self.num_categories] = 0
-			sample['segmentation_onehot']=onehot(t,self.num_categories)
+			if 'mask' in self.sample_keys:
+				sample['mask'] = sample['segmentation'] < self.num_categories
+			if 'segmentation_onehot' in self.sample_keys:
+				t = sample['segmentation'].copy()
+				t[t >= self.num_categories] = 0
+				sample['segmentation_onehot']=onehot(t,self.num_categories,np.float32)
 		return self.totensor(sample)
 
 	def __sample_generate__(self, idx, split_idx=0):
 		name = self.load_name(idx)
 		image = self.load_image(idx)
 		r,c,_ = image.shape
-		sample = {'image': image, 'name': name, 'row': r, 'col': c}
+		sample = Sample(image=image, name=name, row=r, col=c)
 
 		if 'test' in self.period:
 			return self.__transform__(sample)
 		elif self.cfg.DATA_PSEUDO_GT and idx>=split_idx and 'train' in self.period:
 			segmentation = self.load_pseudo_segmentation(idx)
 		else:
-			segmentation = self.load_segmentation(idx)
+			segmentation = self.load_cached_segmentation(idx)
 		sample['segmentation'] = segmentation
-		t = sample['segmentation'].copy()
-		t[t >= self.num_categories] = 0
-		sample['category'] = seg2cls(t,self.num_categories)
-		sample['category_copypaste'] = np.zeros(sample['category'].shape)
+		if 'category' in self.sample_keys:
+			t = sample['segmentation'].copy()
+			t[t >= self.num_categories] = 0
+			sample['category'] = seg2cls(t,self.num_categories)
+		if 'category_copypaste' in self.sample_keys:
+			sample['category_copypaste'] = np.zeros((self.num_categories,1,1))
 
 		#if self.transform == 'none' and self.cfg.DATA_FEATURE_DIR:
 		#	feature = self.load_feature(idx)
@@ -81,18 +104,26 @@ class BaseDataset(Dataset):
 		elif self.transform == 'strong':
 			sample = self.__strong_augment__(sample)
 		else:
-			sample = self.imagenorm(sample)
-			sample = self.multiscale(sample)
+			if not self.uint8:
+				sample = self.imagenorm(sample)
+			if not self.lazy_multiscale:
+				sample = self.multiscale(sample)
 		return sample
 
 	def __weak_augment__(self, sample):
 		if self.cfg.DATA_RANDOM_H>0 or self.cfg.DATA_RANDOM_S>0 or self.cfg.DATA_RANDOM_V>0:
 			sample = self.randomhsv(sample)
+		if self.fused_aug:
+			sample = self.randomscalecropflip(sample)
+			if not self.uint8:
+				sample = self.imagenorm(sample)
+			return sample
 		if self.cfg.DATA_RANDOMFLIP > 0:
 			sample = self.randomflip(sample)
 		if self.cfg.DATA_RANDOMSCALE != 1:
 			sample = self.randomscale(sample)
-		sample = self.imagenorm(sample)
+		if not self.uint8:
+			sample = self.imagenorm(sample)
 		if self.cfg.DATA_RANDOMCROP > 0:
 			sample = self.randomcrop(sample)
 		return sample
@@ -103,26 +134,119 @@ class BaseDataset(Dataset):
 	def __len__(self):
 		raise NotImplementedError
 
+	def shard(self, rank, num_shards):
+		# keep every num_shards-th image starting from rank (sharded evaluation)
+		self.name_list = self.name_list[rank::num_shards]
+
 	def load_name(self, idx):
 		raise NotImplementedError	
 
 	def load_image(self, idx):
 		raise NotImplementedError	
 
+	def image_size(self, idx):
+		# (height, width) of image idx, buckets the test batches (utils.test_utils.size_batch_sampler)
+		return self.load_image(idx).shape[:2]
+
 	def load_segmentation(self, idx):
 		raise NotImplementedError
 
 	def load_pseudo_segmentation(self, idx):
 		raise NotImplementedError
 
+	def load_cached_segmentation(self, idx):
+		# DATA_SEG_CACHE: label pngs written by export_segmentation, already remapped to train ids
+		cache_dir = getattr(self.cfg, 'DATA_SEG_CACHE', None)
+		if not cache_dir:
+			return self.load_segmentation(idx)
+		seg_file = os.path.join(cache_dir, '%s.png'%self.load_name(idx))
+		return np.array(Image.open(seg_file))
+
+	def _export_one(self, idx):
+		file_path = os.path.join(self.export_dir, '%s.png'%self.load_name(idx))
+		if not os.path.exists(os.path.dirname(file_path)):
+			os.makedirs(os.path.dirname(file_path), exist_ok=True)
+		cv2.imwrite(file_path, self.load_segmentation(idx).astype(np.uint8))
+
+	def export_segmentation(self, folder_path, num_workers=8):
+		"""Write the remapped segmentation of every image as a uint8 png (offline conversion for DATA_SEG_CACHE)
+
+		Args:
+			folder_path(str): output folder, use it as cfg.DATA_SEG_CACHE afterwards
+			num_workers(int): number of processes
+
+		"""
+		self.export_dir = folder_path
+		with multiprocessing.Pool(num_workers) as pool:
+			for i, _ in enumerate(pool.imap_unordered(self._export_one, range(len(self)), chunksize=16)):
+				if i % 1000 == 0:
+					print('[%d/%d] exported'%(i, len(self)))
+
 	def load_feature(self, idx):
 		raise NotImplementedError
 		
 	def save_result(self, result_list, model_id):
 		raise NotImplementedError	
 
+	def imwrite(self, file_path, img):
+		# TEST_WRITERS > 0: files are written by background threads, call flush_results before reading them
+		num_writers = getattr(self.cfg, 'TEST_WRITERS', 0)
+		png_compression = getattr(self.cfg, 'TEST_PNG_COMPRESSION', None)
+		if num_writers > 0:
+			if self.writer is None:
+				self.writer = AsyncWriter(num_writers, png_compression=png_compression)
+			self.writer.imwrite(file_path, img)
+		elif png_compression is not None:
+			cv2.imwrite(file_path, img, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+		else:
+			cv2.imwrite(file_path, img)
+
+	def flush_results(self):
+		if self.writer is not None:
+			self.writer.flush()
+
+	def __getstate__(self):
+		# dataloader workers never write results, and the writer threads can not be pickled
+		state = self.__dict__.copy()
+		state['writer'] = None
+		return state
+
 	def save_pseudo_gt(self, result_list, level=None):
 		raise NotImplementedError
 
 	def do_python_eval(self, model_id):
 		raise NotImplementedError
+
+	def iou_log(self, IoU):
+		"""Print the per class IoU and the mIoU, return them (in %) as a log dict
+
+		Args:
+			IoU(list or ndarray): IoU of each class, background first
+
+		"""
+		categories = getattr(self, 'categories', None)
+		if categories is not None and len(categories)+1 == len(IoU) and isinstance(categories[0], str):
+			names = ['background'] + list(categories)
+		else:
+			names = ['class[%d]'%i for i in range(len(IoU))]
+		loglist = {}
+		for i in range(len(IoU)):
+			if i%2 != 1:
+				print('%11s:%7.3f%%'%(names[i],IoU[i]*100),end='\t')
+			else:
+				print('%11s:%7.3f%%'%(names[i],IoU[i]*100))
+			loglist[names[i]] = IoU[i] * 100
+		miou = np.mean(np.array(IoU))
+		print('\n======================================================')
+		print('%11s:%7.3f%%'%('mIoU',miou*100))
+		loglist['mIoU'] = miou * 100
+		return loglist
+
+	def do_online_eval(self, metric):
+		"""Score the predictions accumulated online during the test loop
+
+		Args:
+			metric(ConfusionMatrix): confusion matrix filled by single_gpu_test
+
+		"""
+		return self.iou_log(metric.iou())
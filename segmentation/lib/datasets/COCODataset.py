@@ -9,13 +9,16 @@ import torch
 import pandas as pd
 import cv2
 import json
-from tqdm import trange
+import multiprocessing
+from tqdm import tqdm, trange
 from skimage import io
 from PIL import Image
 import numpy as np
 from pycocotools.coco import COCO
 from torch.utils.data import Dataset
 from datasets.transform import *
+from datasets.coco_index import COCOIndex
+from utils.palette import palette_lut, colorize
 from utils.registry import DATASETS
 
 class COCODataset(Dataset):
@@ -38,25 +41,49 @@ class COCODataset(Dataset):
         self.randomhsv = None
         self.totensor = ToTensor()
         self.cfg = cfg
-        self.json_category_id_to_contiguous_id = {v: i + 1 for i, v in enumerate(self.coco.getCatIds())}
-
-
-        self.coco2voc = [0]*91
-        for voc_idx in range(len(self.voc2coco)):
-            for coco_idx in self.voc2coco[voc_idx]:
-                self.coco2voc[coco_idx] = voc_idx
-                
-        self.coco = COCO(self.ann_dir)
-        self.categories = self.coco.loadCats(self.coco.getCatIds())
-#       self.imgIds = self.coco.getImgIds()
-        self.catIds = self.coco.getCatIds()
-        from pycocotools import mask
-        self.coco_mask = mask
+
+        if hasattr(self, 'voc2coco'):
+            self.coco2voc = [0]*91
+            for voc_idx in range(len(self.voc2coco)):
+                for coco_idx in self.voc2coco[voc_idx]:
+                    self.coco2voc[coco_idx] = voc_idx
+
+        # DATA_SEG_CACHE: semantic masks rasterized offline by export_segmentation,
+        # the annotation json and the COCO api object are not loaded at all
+        self.seg_cache = getattr(cfg, 'DATA_SEG_CACHE', None)
+        self.index_file = os.path.join(self.seg_cache, 'index_%s%s.pkl'%(self.period,self.year)) if self.seg_cache else None
+        if self.index_file is not None and os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                index = pickle.load(f)
+            self.coco = None
+            self.coco_index = None
+            self.file_names = index['file_names']
+            ids = index['ids']
+        elif getattr(cfg, 'DATA_COCO_INDEX', False):
+            # DATA_COCO_INDEX: mmap-ed columnar index instead of the COCO api object,
+            # built from the json on the first run and shared by the DataLoader workers
+            self.coco = None
+            self.coco_index = COCOIndex.load(self.ann_dir)
+            self.json_category_id_to_contiguous_id = {v: i + 1 for i, v in enumerate(self.coco_index.getCatIds())}
+            self.categories = None
+            self.catIds = self.coco_index.getCatIds()
+            self.file_names = None
+            ids = self.coco_index.getImgIds()
+        else:
+            self.coco = COCO(self.ann_dir)
+            self.coco_index = None
+            self.json_category_id_to_contiguous_id = {v: i + 1 for i, v in enumerate(self.coco.getCatIds())}
+            self.categories = self.coco.loadCats(self.coco.getCatIds())
+#           self.imgIds = self.coco.getImgIds()
+            self.catIds = self.coco.getCatIds()
+            from pycocotools import mask
+            self.coco_mask = mask
+            self.file_names = None
+            ids = list(self.coco.imgs.keys())
         if os.path.exists(self.ids_file):
             with open(self.ids_file, 'rb') as f:
                 self.imgIds = pickle.load(f)
         else:
-            ids = list(self.coco.imgs.keys())
             self.imgIds = ids#self._preprocess(ids, self.ids_file)
 
         self.transforms = []
@@ -79,6 +106,19 @@ class COCODataset(Dataset):
     def __len__(self):
         return len(self.imgIds)
 
+    def file_name(self, img_id):
+        if self.file_names is not None:
+            return self.file_names[img_id]
+        if self.coco_index is not None:
+            return self.coco_index.file_name(img_id)
+        return self.coco.loadImgs(img_id)[0]['file_name']
+
+    def image_size(self, img_id):
+        if self.coco_index is not None:
+            return self.coco_index.image_size(img_id)
+        img = self.coco.imgs[img_id]
+        return img['height'], img['width']
+
     def __getitem__(self, idx):
         raise NotImplementedError
 
@@ -88,8 +128,8 @@ class COCOSmtSegDataset(COCODataset):
         super(COCOSmtSegDataset, self).__init__(cfg, period)
 
     def __getitem__(self, idx):
-        img_ann = self.coco.loadImgs(self.imgIds[idx])
-        name = os.path.join(self.img_dir, img_ann[0]['file_name'])
+        file_name = self.file_name(self.imgIds[idx])
+        name = os.path.join(self.img_dir, file_name)
         image = cv2.imread(name)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         r,c,_ = image.shape
@@ -97,12 +137,12 @@ class COCOSmtSegDataset(COCODataset):
 
         
         if self.period == 'train':
-            annIds = self.coco.getAnnIds(imgIds=self.imgIds[idx])
-            anns = self.coco.loadAnns(annIds)
-            segmentation = np.zeros((r,c),dtype=np.uint8)
-            for ann_item in anns:
-                mask = self.coco.annToMask(ann_item)
-                segmentation[mask>0] = self.json_category_id_to_contiguous_id[ann_item['category_id']]
+            if self.file_names is not None:
+                # DATA_SEG_CACHE: the mask rasterized by export_segmentation
+                segmentation = np.array(Image.open(os.path.join(self.seg_cache, '%s.png'%file_name[:-4])))
+            else:
+                # from the annotations, of the DATA_COCO_INDEX index or of the COCO api object
+                segmentation = self._ann_to_segmentation(self.imgIds[idx], r, c)
             if np.max(segmentation)>91:
                 print(np.max(segmentation))
                 raise ValueError('segmentation > 91')
@@ -121,6 +161,11 @@ class COCOSmtSegDataset(COCODataset):
         return sample
  
     def label2colormap(self, label):
+        if not hasattr(self, 'palette'):
+            self.palette = palette_lut(self.__label2colormap)
+        return colorize(label, self.palette)
+
+    def __label2colormap(self, label):
         m = label.astype(np.uint8)
         r,c = m.shape
         cmap = np.zeros((r,c,3), dtype=np.uint8)
@@ -128,6 +173,47 @@ class COCOSmtSegDataset(COCODataset):
         cmap[:,:,1] = (m&2)<<6 | (m&16)<<2 | (m&128)>>2
         cmap[:,:,2] = (m&4)<<5 | (m&32)<<1
         return cmap
+    def _ann_to_segmentation(self, img_id, h, w):
+        segmentation = np.zeros((h,w),dtype=np.uint8)
+        if self.coco_index is not None:
+            for category_id, mask in self.coco_index.ann_masks(img_id):
+                segmentation[mask>0] = self.json_category_id_to_contiguous_id[category_id]
+            return segmentation
+        anns = self.coco.loadAnns(self.coco.getAnnIds(imgIds=img_id))
+        for ann_item in anns:
+            mask = self.coco.annToMask(ann_item)
+            segmentation[mask>0] = self.json_category_id_to_contiguous_id[ann_item['category_id']]
+        return segmentation
+
+    def export_segmentation(self, folder_path, num_workers=8, min_pixels=1000):
+        """Rasterize the semantic mask of every image once (offline, for DATA_SEG_CACHE)
+
+        Writes <file_name>.png (uint8, contiguous category ids) per image, an
+        index_<period><year>.pkl with the image ids and file names, and the
+        ids of the images with more than min_pixels foreground pixels to
+        ids_file, as _preprocess does.
+        """
+        if self.coco is None and self.coco_index is None:
+            raise ValueError('COCOSmtSegDataset: export_segmentation needs the annotations, DATA_SEG_CACHE is already built')
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        ids = self.coco_index.getImgIds() if self.coco_index is not None else list(self.coco.imgs.keys())
+        global _export_dataset, _export_dir
+        # the workers are forked and share the COCO object, nothing is pickled per task
+        _export_dataset, _export_dir = self, folder_path
+        qualified = []
+        with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+            for img_id, num_fg in tqdm(pool.imap(_export_one, ids, chunksize=64), total=len(ids)):
+                if num_fg > min_pixels:
+                    qualified.append(img_id)
+        print('Found number of qualified images: ', len(qualified))
+        index = {'ids': ids, 'file_names': {img_id: self.file_name(img_id) for img_id in ids}}
+        with open(os.path.join(folder_path, 'index_%s%s.pkl'%(self.period,self.year)), 'wb') as f:
+            pickle.dump(index, f)
+        with open(self.ids_file, 'wb') as f:
+            pickle.dump(qualified, f)
+        return qualified
+
     def _gen_seg_mask(self, target, h, w):
         mask = np.zeros((h, w), dtype=np.uint8)
         coco_mask = self.coco_mask
@@ -283,6 +369,15 @@ class COCOInsDataset(COCODataset):
         mat = np.mul(v.T, v)
         return mat
 
+_export_dataset = None
+_export_dir = None
+
+def _export_one(img_id):
+    h, w = _export_dataset.image_size(img_id)
+    segmentation = _export_dataset._ann_to_segmentation(img_id, h, w)
+    cv2.imwrite(os.path.join(_export_dir, '%s.png'%_export_dataset.file_name(img_id)[:-4]), segmentation)
+    return img_id, int((segmentation > 0).sum())
+
 def xyxy2xywh(bbox):
     _bbox = bbox.tolist()
     return [
@@ -15,6 +15,7 @@ from torch.utils.data import Dataset
 from datasets.transform import *
 from utils.imutils import *
 from collections import namedtuple
+from utils.palette import palette_lut, colorize
 from utils.registry import DATASETS
 from datasets.BaseDataset import BaseDataset
 
@@ -93,6 +94,9 @@ class CityscapesDataset(BaseDataset):
 		]
 		self.id2label = {label.id: label for label in self.categories}
 		self.trainId2label = {label.trainId : label for label in reversed(self.categories)}
+		self.id2trainid_lut = label_lut(self.__id2trainid_loop__)
+		self.palette = {id_version: palette_lut(lambda label, v=id_version: self.__label2colormap(label, v))
+				for id_version in ['id', 'trainid']}
 		self.num_categories = 19
 		assert self.num_categories == self.cfg.MODEL_NUM_CLASSES
 		
@@ -111,12 +115,15 @@ class CityscapesDataset(BaseDataset):
 		image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 		return image
 
-	def __id2trainid__(self, seg):
+	def __id2trainid_loop__(self, seg):
 		for label in self.categories:
 			seg[seg == label.id] = label.trainId
 		#seg[seg==-1] = 34
 		return seg
 
+	def __id2trainid__(self, seg):
+		return apply_lut(seg, self.id2trainid_lut)
+
 	def load_segmentation(self, idx):
 		name = self.name_list[idx]
 		seg_file = os.path.join(self.seg_dir, name + '_gtFine_labelIds.png')
@@ -138,7 +145,7 @@ class CityscapesDataset(BaseDataset):
 		for sample in result_list:
 			name = sample['name'].split('/')
 			file_path = os.path.join(folder_path, '%s.png'%name[1])
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 			print('%s saved'%(file_path))
 
 	def do_python_eval(self, model_id):
@@ -146,6 +153,9 @@ class CityscapesDataset(BaseDataset):
 
 
 	def label2colormap(self, label, id_version='trainid'):
+		return colorize(label, self.palette[id_version])
+
+	def __label2colormap(self, label, id_version='trainid'):
 		m = label.astype(np.uint8)
 		r,c = m.shape
 		cmap = np.zeros((r,c,3), dtype=np.uint8)
@@ -179,7 +189,7 @@ class CityscapesDataset(BaseDataset):
 			file_path = os.path.join(folder_path, '%s.png'%name[1])
 			# predict_color = self.label2colormap(sample['predict'])
 			# p = self.__coco2voc(sample['predict'])
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 			print('[%d/%d] %s saved'%(i,len(result_list),file_path))
 			i+=1
 	
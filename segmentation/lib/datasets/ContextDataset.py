@@ -14,6 +14,8 @@ from PIL import Image
 import numpy as np
 from torch.utils.data import Dataset
 from datasets.transform import *
+from utils.imutils import label_lut, apply_lut
+from utils.palette import bitwise_palette, palette_lut, colorize
 from utils.registry import DATASETS
 from datasets.BaseDataset import BaseDataset
 
@@ -43,6 +45,9 @@ class ContextDataset(BaseDataset):
 		self.num_categories = len(self.categories)+1
 		assert self.num_categories == self.cfg.MODEL_NUM_CLASSES
 		self.cmap = self.__colormap(self.num_categories)
+		self.palette = palette_lut(self.__label2colormap)
+		# the 459 full Context labels are stored as uint16, the lut covers every value
+		self.label_lut = label_lut(self.__labelremap, 65536)
 
 	def __len__(self):
 		return len(self.name_list)
@@ -58,10 +63,19 @@ class ContextDataset(BaseDataset):
 		image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 		return image_rgb
 
+	def image_size(self, idx):
+		# from the jpeg header only
+		name = self.name_list[idx]
+		w, h = Image.open(self.img_dir + '/' + name + '.jpg').size
+		return h, w
+
 	def load_segmentation(self, idx):
 		name = self.name_list[idx]
 		seg_file = self.seg_dir + '/' + name + '.mat'
 		segmentation = scio.loadmat(seg_file)['LabelMap']
+		return apply_lut(segmentation, self.label_lut)
+
+	def __labelremap(self, segmentation):
 		for i in range(len(self.label_mapping)):
 			segmentation[segmentation==i] = self.label_mapping[i] 
 		segmentation[segmentation>len(self.categories)] = 0
@@ -116,29 +130,12 @@ class ContextDataset(BaseDataset):
 			return: a Nx3 matrix
 
 		"""
-		cmap = np.zeros((N, 3), dtype = np.uint8)
-
-		def uint82bin(n, count=8):
-			"""returns the binary of integer n, count refers to amount of bits"""
-			return ''.join([str((n >> y) & 1) for y in range(count-1, -1, -1)])
-
-		for i in range(N):
-			r = 0
-			g = 0
-			b = 0
-			idx = i
-			for j in range(7):
-				str_id = uint82bin(idx)
-				r = r ^ ( np.uint8(str_id[-1]) << (7-j))
-				g = g ^ ( np.uint8(str_id[-2]) << (7-j))
-				b = b ^ ( np.uint8(str_id[-3]) << (7-j))
-				idx = idx >> 3
-			cmap[i, 0] = r
-			cmap[i, 1] = g
-			cmap[i, 2] = b
-		return cmap
+		return bitwise_palette(N)
 	
 	def label2colormap(self, label):
+		return colorize(label, self.palette)
+
+	def __label2colormap(self, label):
 		m = label.astype(np.uint8)
 		r,c = m.shape
 		cmap = np.zeros((r,c,3), dtype=np.uint8)
@@ -160,7 +157,7 @@ class ContextDataset(BaseDataset):
 			os.makedirs(folder_path)
 		for sample in result_list:
 			file_path = os.path.join(folder_path, '%s.png'%sample['name'])
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 			print('[%d/%d] %s saved'%(i,len(result_list),file_path))
 			i+=1
 
@@ -199,10 +196,7 @@ class ContextDataset(BaseDataset):
 				gt_file = os.path.join(gt_folder,'%s.mat'%name)
 				predict = np.array(Image.open(predict_file)) #cv2.imread(predict_file)
 				#gt = np.array(Image.open(gt_file))
-				gt = scio.loadmat(gt_file)['LabelMap']
-				for i in range(len(self.label_mapping)):
-					gt[gt==i] = self.label_mapping[i] 
-				gt[gt>len(self.categories)] = 0
+				gt = apply_lut(scio.loadmat(gt_file)['LabelMap'], self.label_lut)
 				cal = gt<255
 				mask = (predict==gt) * cal
 		  
@@ -226,23 +220,7 @@ class ContextDataset(BaseDataset):
 		IoU = []
 		for i in range(self.cfg.MODEL_NUM_CLASSES):
 			IoU.append(TP[i].value/(T[i].value+P[i].value-TP[i].value+1e-10))
-		loglist = {}
-		for i in range(self.cfg.MODEL_NUM_CLASSES):
-			if i == 0:
-				print('%11s:%7.3f%%'%('background',IoU[i]*100),end='\t')
-				loglist['background'] = IoU[i]*100
-			else:
-				if i%2 != 1:
-					print('%11s:%7.3f%%'%(self.categories[i-1],IoU[i]*100),end='\t')
-				else:
-					print('%11s:%7.3f%%'%(self.categories[i-1],IoU[i]*100))
-				loglist[self.categories[i-1]] = IoU[i]*100
-					
-		miou = np.mean(np.array(IoU))
-		print('\n======================================================')
-		print('%11s:%7.3f%%'%('mIoU',miou*100))	
-		loglist['mIoU'] = miou*100
-		return loglist
+		return self.iou_log(IoU)
 
 #@DATASETS.register_module
 class Semi_ContextDataset(ContextDataset):
@@ -14,6 +14,7 @@ import numpy as np
 from torch.utils.data import Dataset
 from datasets.transform import *
 from utils.imutils import *
+from utils.palette import bitwise_palette, palette_lut, colorize
 from utils.registry import DATASETS
 from datasets.BaseDataset import BaseDataset
 
@@ -51,6 +52,7 @@ class VOCDataset(BaseDataset):
 
 			self.num_categories = len(self.categories)+1
 			self.cmap = self.__colormap(len(self.categories)+1)
+		self.palette = palette_lut(self.__label2colormap)
 
 	def __len__(self):
 		return len(self.name_list)
@@ -66,6 +68,12 @@ class VOCDataset(BaseDataset):
 		image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 		return image_rgb
 
+	def image_size(self, idx):
+		# from the jpeg header only
+		name = self.name_list[idx]
+		w, h = Image.open(self.img_dir + '/' + name + '.jpg').size
+		return h, w
+
 	def load_segmentation(self, idx):
 		name = self.name_list[idx]
 		seg_file = self.seg_dir + '/' + name + '.png'
@@ -87,33 +95,16 @@ class VOCDataset(BaseDataset):
 			return: a Nx3 matrix
 
 		"""
-		cmap = np.zeros((N, 3), dtype = np.uint8)
-
-		def uint82bin(n, count=8):
-			"""returns the binary of integer n, count refers to amount of bits"""
-			return ''.join([str((n >> y) & 1) for y in range(count-1, -1, -1)])
-
-		for i in range(N):
-			r = 0
-			g = 0
-			b = 0
-			idx = i
-			for j in range(7):
-				str_id = uint82bin(idx)
-				r = r ^ ( np.uint8(str_id[-1]) << (7-j))
-				g = g ^ ( np.uint8(str_id[-2]) << (7-j))
-				b = b ^ ( np.uint8(str_id[-3]) << (7-j))
-				idx = idx >> 3
-			cmap[i, 0] = r
-			cmap[i, 1] = g
-			cmap[i, 2] = b
-		return cmap
+		return bitwise_palette(N)
 
 	def load_ranked_namelist(self):
 		df = self.read_rank_result()
 		self.name_list = df['filename'].values
 
 	def label2colormap(self, label):
+		return colorize(label, self.palette)
+
+	def __label2colormap(self, label):
 		m = label.astype(np.uint8)
 		r,c = m.shape
 		cmap = np.zeros((r,c,3), dtype=np.uint8)
@@ -136,7 +127,7 @@ class VOCDataset(BaseDataset):
 			
 		for sample in result_list:
 			file_path = os.path.join(folder_path, '%s.png'%sample['name'])
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 
 	def save_pseudo_gt(self, result_list, folder_path=None):
 		"""Save pseudo gt
@@ -151,7 +142,7 @@ class VOCDataset(BaseDataset):
 			os.makedirs(folder_path)
 		for sample in result_list:
 			file_path = os.path.join(folder_path, '%s.png'%(sample['name']))
-			cv2.imwrite(file_path, sample['predict'])
+			self.imwrite(file_path, sample['predict'])
 			i+=1
 
 	def do_matlab_eval(self, model_id):
@@ -212,30 +203,17 @@ class VOCDataset(BaseDataset):
 		IoU = []
 		for i in range(self.num_categories):
 			IoU.append(TP[i].value/(T[i].value+P[i].value-TP[i].value+1e-10))
-		loglist = {}
-		for i in range(self.num_categories):
-			if i == 0:
-				print('%11s:%7.3f%%'%('background',IoU[i]*100),end='\t')
-				loglist['background'] = IoU[i] * 100 
-			else:
-				if i%2 != 1:
-					print('%11s:%7.3f%%'%(self.categories[i-1],IoU[i]*100),end='\t')
-				else:
-					print('%11s:%7.3f%%'%(self.categories[i-1],IoU[i]*100))
-				loglist[self.categories[i-1]] = IoU[i] * 100
-					
-		miou = np.mean(np.array(IoU))
-		print('\n======================================================')
-		print('%11s:%7.3f%%'%('mIoU',miou*100))
-		loglist['mIoU'] = miou * 100
-		return loglist
+		return self.iou_log(IoU)
 
 	def __coco2voc(self, m):
-		r,c = m.shape
-		result = np.zeros((r,c),dtype=np.uint8)
-		for i in range(0,21):
-			for j in self.coco2voc[i]:
-				result[m==j] = i
-		return result
+		if not hasattr(self, 'coco2voc_lut'):
+			def remap(lut):
+				result = np.zeros(lut.shape, dtype=lut.dtype)
+				for i in range(0,21):
+					for j in self.coco2voc[i]:
+						result[lut==j] = i
+				lut[:] = result
+			self.coco2voc_lut = label_lut(remap)
+		return apply_lut(m, self.coco2voc_lut)
 
 
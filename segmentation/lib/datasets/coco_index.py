@@ -0,0 +1,117 @@
+# ----------------------------------------
+# Columnar COCO annotation index
+# ----------------------------------------
+
+import os
+import json
+import shutil
+import numpy as np
+from pycocotools import mask as coco_mask
+
+class COCOIndex(object):
+    """Compact, read-only replacement of the pycocotools COCO object for semantic segmentation.
+
+    Every field is a flat numpy array saved as .npy next to the annotation json
+    and opened with mmap_mode='r', so DataLoader workers share the pages instead
+    of copying a python dict graph, and later runs skip parsing the json:
+
+        img_ids, heights, widths    per image, sorted by image id
+        name_offsets, names         file names, utf-8 bytes of image i in names[name_offsets[i]:name_offsets[i+1]]
+        ann_offsets                 annotations of image i are ann_offsets[i]:ann_offsets[i+1]
+        ann_category                raw COCO category id of each annotation
+        rle_offsets, rles           compressed RLE counts of each annotation (polygons are converted at build time)
+        cat_ids                     sorted category ids
+    """
+    FIELDS = ['img_ids', 'heights', 'widths', 'name_offsets', 'names',
+              'ann_offsets', 'ann_category', 'rle_offsets', 'rles', 'cat_ids']
+
+    def __init__(self, index_dir):
+        for field in self.FIELDS:
+            setattr(self, field, np.load(os.path.join(index_dir, field + '.npy'), mmap_mode='r'))
+
+    @classmethod
+    def load(cls, ann_file, index_dir=None):
+        # builds the index on the first call, mmaps the cached arrays afterwards
+        if index_dir is None:
+            index_dir = os.path.splitext(ann_file)[0] + '_index'
+        if not os.path.exists(os.path.join(index_dir, 'cat_ids.npy')):
+            cls.build(ann_file, index_dir)
+        return cls(index_dir)
+
+    @classmethod
+    def build(cls, ann_file, index_dir):
+        print('building COCO index %s ...'%index_dir)
+        with open(ann_file, 'r') as f:
+            dataset = json.load(f)
+        images = sorted(dataset['images'], key=lambda img: img['id'])
+        img_ids = np.array([img['id'] for img in images], dtype=np.int64)
+        size = {img['id']: (img['height'], img['width']) for img in images}
+        names = [img['file_name'].encode('utf-8') for img in images]
+
+        # stable sort: the annotations of an image keep their json order, as in COCO.getAnnIds
+        anns = sorted(dataset['annotations'], key=lambda ann: ann['image_id'])
+        ann_img = np.array([ann['image_id'] for ann in anns], dtype=np.int64)
+        rles = []
+        for ann in anns:
+            h, w = size[ann['image_id']]
+            segm = ann['segmentation']
+            if isinstance(segm, list):
+                rle = coco_mask.merge(coco_mask.frPyObjects(segm, h, w))
+            elif isinstance(segm['counts'], list):
+                rle = coco_mask.frPyObjects(segm, h, w)
+            else:
+                rle = segm
+            counts = rle['counts']
+            rles.append(counts.encode('ascii') if isinstance(counts, str) else counts)
+
+        fields = {
+            'img_ids': img_ids,
+            'heights': np.array([img['height'] for img in images], dtype=np.int32),
+            'widths': np.array([img['width'] for img in images], dtype=np.int32),
+            'name_offsets': np.cumsum([0] + [len(n) for n in names]).astype(np.int64),
+            'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+            'ann_offsets': np.searchsorted(ann_img, np.append(img_ids, np.iinfo(np.int64).max)).astype(np.int64),
+            'ann_category': np.array([ann['category_id'] for ann in anns], dtype=np.int32),
+            'rle_offsets': np.cumsum([0] + [len(r) for r in rles]).astype(np.int64),
+            'rles': np.frombuffer(b''.join(rles), dtype=np.uint8),
+            'cat_ids': np.array(sorted(cat['id'] for cat in dataset['categories']), dtype=np.int32),
+        }
+        # written to a temporary folder first, so an interrupted build is never loaded
+        tmp_dir = index_dir + '.tmp%d'%os.getpid()
+        os.makedirs(tmp_dir)
+        for field in cls.FIELDS:
+            np.save(os.path.join(tmp_dir, field + '.npy'), fields[field])
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.rename(tmp_dir, index_dir)
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    def getImgIds(self):
+        return self.img_ids.tolist()
+
+    def getCatIds(self):
+        return self.cat_ids.tolist()
+
+    def row(self, img_id):
+        i = int(np.searchsorted(self.img_ids, img_id))
+        if i >= len(self.img_ids) or self.img_ids[i] != img_id:
+            raise KeyError('COCOIndex: image id %d not found'%img_id)
+        return i
+
+    def file_name(self, img_id):
+        i = self.row(img_id)
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i+1]]).decode('utf-8')
+
+    def image_size(self, img_id):
+        i = self.row(img_id)
+        return int(self.heights[i]), int(self.widths[i])
+
+    def ann_masks(self, img_id):
+        # (category id, h x w uint8 mask) of every annotation of img_id, in json order
+        i = self.row(img_id)
+        h, w = int(self.heights[i]), int(self.widths[i])
+        for a in range(self.ann_offsets[i], self.ann_offsets[i+1]):
+            counts = bytes(self.rles[self.rle_offsets[a]:self.rle_offsets[a+1]])
+            yield int(self.ann_category[a]), coco_mask.decode({'size': [h, w], 'counts': counts})
@@ -84,12 +84,9 @@ def colorEncode(labelmap, colors, mode='BGR'):
     labelmap = labelmap.astype('int')
     labelmap_rgb = np.zeros((labelmap.shape[0], labelmap.shape[1], 3),
                             dtype=np.uint8)
-    for label in unique(labelmap):
-        if label < 0:
-            continue
-        labelmap_rgb += (labelmap == label)[:, :, np.newaxis] * \
-            np.tile(colors[label],
-                    (labelmap.shape[0], labelmap.shape[1], 1))
+    # one fancy index into the palette, negative labels stay black
+    valid = labelmap >= 0
+    labelmap_rgb[valid] = np.asarray(colors, dtype=np.uint8)[labelmap[valid]]
 
     if mode == 'BGR':
         return labelmap_rgb[:, :, ::-1]
@@ -128,6 +125,42 @@ def intersectionAndUnion(imPred, imLab, numClass):
     return (area_intersection, area_union)
 
 
+class ConfusionMatrix(object):
+    """Accumulates a num_class x num_class confusion matrix (rows: ground truth,
+    columns: prediction) image by image, so the IoU can be read at any time
+    without going back to the files. Ground truth labels >= num_class (255) are ignored."""
+    def __init__(self, num_class):
+        self.num_class = num_class
+        self.mat = np.zeros((num_class, num_class), dtype=np.int64)
+
+    def update(self, pred, gt):
+        pred = np.asarray(pred).reshape(-1).astype(np.int64)
+        gt = np.asarray(gt).reshape(-1).astype(np.int64)
+        valid = gt < self.num_class
+        index = gt[valid] * self.num_class + np.clip(pred[valid], 0, self.num_class - 1)
+        self.mat += np.bincount(index, minlength=self.num_class ** 2).reshape(self.num_class, self.num_class)
+
+    def merge(self, other):
+        self.mat += other.mat if isinstance(other, ConfusionMatrix) else other
+        return self
+
+    def reset(self):
+        self.mat[:] = 0
+
+    def iou(self):
+        tp = np.diag(self.mat).astype(np.float64)
+        return tp / (self.mat.sum(0) + self.mat.sum(1) - tp + 1e-10)
+
+    def miou(self):
+        return np.mean(self.iou())
+
+    def save(self, file_path):
+        np.save(file_path, self.mat)
+
+    def load(self, file_path):
+        return self.merge(np.load(file_path))
+
+
 class NotSupportedCliException(Exception):
     pass
 
@@ -9,6 +9,90 @@ import random
 import PIL
 from PIL import Image, ImageOps, ImageFilter
 
+IMAGE = 'image'
+LABEL = 'label'
+META = 'meta'
+_key_group = dict()
+
+def key_group(key):
+	"""Schema group of a sample key, resolved once per key name
+
+	IMAGE: H x W x C images ('image', 'image_%f'), interpolated and padded with the image fill
+	LABEL: H x W label maps ('segmentation', 'segmentation_pseudo*'), nearest and padded with 255
+	META: everything else, left alone by the geometric transforms
+	"""
+	group = _key_group.get(key)
+	if group is None:
+		if 'image' in key:
+			group = IMAGE
+		elif 'segmentation' == key or 'segmentation_pseudo' in key:
+			group = LABEL
+		else:
+			group = META
+		_key_group[key] = group
+	return group
+
+class Sample(dict):
+	"""A sample dict with a declared schema: its keys fall into the IMAGE / LABEL /
+	META groups of key_group, so a transform handles each group as a whole."""
+	def keys_of(self, group):
+		return [key for key in self.keys() if key_group(key) == group]
+
+def group_keys(sample, group):
+	if isinstance(sample, Sample):
+		return sample.keys_of(group)
+	return [key for key in sample.keys() if key_group(key) == group]
+
+def stack_group(sample, keys):
+	"""The arrays of keys as one H x W x C buffer and the channels of each key.
+	A single key is used as is, several keys are concatenated once."""
+	arrays = [sample[key] if sample[key].ndim == 3 else sample[key][:,:,np.newaxis] for key in keys]
+	channels = [a.shape[2] for a in arrays]
+	if len(arrays) == 1:
+		return arrays[0], channels
+	return np.concatenate(arrays, axis=2), channels
+
+def unstack_group(sample, keys, buffer, channels, dtype=None):
+	"""Inverse of stack_group: views of buffer back into the sample, keeping each
+	key's rank and dtype (or converting to dtype if given)"""
+	if buffer.ndim == 2:
+		buffer = buffer[:,:,np.newaxis]
+	start = 0
+	for key, c in zip(keys, channels):
+		value = buffer[:,:,start:start+c]
+		if sample[key].ndim == 2:
+			value = value[:,:,0]
+		sample[key] = value.astype(sample[key].dtype if dtype is None else dtype, copy=False)
+		start += c
+	return sample
+
+def crop_window(h, w, output_size):
+	"""Random crop of a h x w image into an output_size container.
+
+	Returns the size ch x cw of the copied window, its position in the container
+	(cont_top, cont_left) and in the image (img_top, img_left).
+	"""
+	ch = min(h, output_size[0])
+	cw = min(w, output_size[1])
+	
+	h_space = h - output_size[0]
+	w_space = w - output_size[1]
+
+	if w_space > 0:
+		cont_left = 0
+		img_left = random.randrange(w_space+1)
+	else:
+		cont_left = random.randrange(-w_space+1)
+		img_left = 0
+
+	if h_space > 0:
+		cont_top = 0
+		img_top = random.randrange(h_space+1)
+	else:
+		cont_top = random.randrange(-h_space+1)
+		img_top = 0
+	return ch, cw, cont_top, cont_left, img_top, img_left
+
 class RandomCrop(object):
 	"""Crop randomly the image in a sample.
 
@@ -17,88 +101,66 @@ class RandomCrop(object):
 			is made.
 	"""
 
-	def __init__(self, output_size):
+	def __init__(self, output_size, image_fill=0):
 		assert isinstance(output_size, (int, tuple))
 		if isinstance(output_size, int):
 			self.output_size = (output_size, output_size)
 		else:
 			assert len(output_size) == 2
 			self.output_size = output_size
+		self.image_fill = image_fill
 
 	def __call__(self, sample):
 
 		h, w = sample['image'].shape[:2]
-		ch = min(h, self.output_size[0])
-		cw = min(w, self.output_size[1])
-		
-		h_space = h - self.output_size[0]
-		w_space = w - self.output_size[1]
-
-		if w_space > 0:
-			cont_left = 0
-			img_left = random.randrange(w_space+1)
-		else:
-			cont_left = random.randrange(-w_space+1)
-			img_left = 0
+		ch, cw, cont_top, cont_left, img_top, img_left = crop_window(h, w, self.output_size)
 
-		if h_space > 0:
-			cont_top = 0
-			img_top = random.randrange(h_space+1)
-		else:
-			cont_top = random.randrange(-h_space+1)
-			img_top = 0
-
-		key_list = sample.keys()
-		for key in key_list:
-			if 'image' in key:
-				img = sample[key]
-				img_crop = np.zeros((self.output_size[0], self.output_size[1], 3), np.float32)
-				img_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = \
-						 img[img_top:img_top+ch, img_left:img_left+cw]
-				#img_crop = img[img_top:img_top+ch, img_left:img_left+cw]
-				sample[key] = img_crop
-			elif 'segmentation' == key:
-				seg = sample[key]
-				seg_crop = np.ones((self.output_size[0], self.output_size[1]), np.float32)*255
-				seg_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = \
-						 seg[img_top:img_top+ch, img_left:img_left+cw]
-				#seg_crop = seg[img_top:img_top+ch, img_left:img_left+cw]
-				sample[key] = seg_crop
-			elif 'segmentation_pseudo' in key:
-				seg_pseudo = sample[key]
-				seg_crop = np.ones((self.output_size[0], self.output_size[1]), np.float32)*255
-				seg_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = \
-						 seg_pseudo[img_top:img_top+ch, img_left:img_left+cw]
-				#seg_crop = seg_pseudo[img_top:img_top+ch, img_left:img_left+cw]
-				sample[key] = seg_crop
+		# one container per group: every image and every label map is cropped in a single copy
+		image_keys = group_keys(sample, IMAGE)
+		if len(image_keys) > 0:
+			img, channels = stack_group(sample, image_keys)
+			img_crop = np.empty((self.output_size[0], self.output_size[1], img.shape[2]), img.dtype)
+			img_crop[...] = np.tile(self.image_fill, img.shape[2]//3) if np.ndim(self.image_fill) > 0 else self.image_fill
+			img_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = \
+					 img[img_top:img_top+ch, img_left:img_left+cw]
+			unstack_group(sample, image_keys, img_crop, channels)
+		label_keys = group_keys(sample, LABEL)
+		if len(label_keys) > 0:
+			seg, channels = stack_group(sample, label_keys)
+			seg_crop = np.full((self.output_size[0], self.output_size[1], seg.shape[2]), 255, np.float32)
+			seg_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = \
+					 seg[img_top:img_top+ch, img_left:img_left+cw]
+			unstack_group(sample, label_keys, seg_crop, channels, np.float32)
 		return sample
 
 class RandomHSV(object):
-	"""Generate randomly the image in hsv space."""
+	"""Generate randomly the image in hsv space.
+
+	The h / s / v shifts are one 256 x 3 lookup table per sample, applied
+	with a single cv2.LUT on the uint8 hsv image: h -> (h + delta_h) % 180,
+	s / v -> clip(x + delta, 0, 255).
+	"""
 	def __init__(self, h_r, s_r, v_r):
 		self.h_r = h_r
 		self.s_r = s_r
 		self.v_r = v_r
+		self.index = np.arange(256, dtype=np.int32)
+
+	def get_lut(self, delta_h, delta_s, delta_v):
+		lut = np.empty((256, 1, 3), np.uint8)
+		lut[:,0,0] = (self.index + delta_h)%180
+		lut[:,0,1] = np.clip(self.index + delta_s, 0, 255)
+		lut[:,0,2] = np.clip(self.index + delta_v, 0, 255)
+		return lut
 
 	def __call__(self, sample):
 		image = sample['image']
 		hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-		h = hsv[:,:,0].astype(np.int32)
-		s = hsv[:,:,1].astype(np.int32)
-		v = hsv[:,:,2].astype(np.int32)
 		delta_h = random.randint(-self.h_r,self.h_r)
 		delta_s = random.randint(-self.s_r,self.s_r)
 		delta_v = random.randint(-self.v_r,self.v_r)
-		h = (h + delta_h)%180
-		s = s + delta_s
-		s[s>255] = 255
-		s[s<0] = 0
-		v = v + delta_v
-		v[v>255] = 255
-		v[v<0] = 0
-		hsv = np.stack([h,s,v], axis=-1).astype(np.uint8)	
-		image = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB).astype(np.uint8)
-		sample['image'] = image
+		cv2.LUT(hsv, self.get_lut(delta_h, delta_s, delta_v), dst=hsv)
+		sample['image'] = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
 		return sample
 
 class RandomFlip(object):
@@ -107,20 +169,8 @@ class RandomFlip(object):
 		self.flip_t = threshold
 	def __call__(self, sample):
 		if random.random() < self.flip_t:
-			key_list = sample.keys()
-			for key in key_list:
-				if 'image' in key:
-					img = sample[key]
-					img = np.flip(img, axis=1)
-					sample[key] = img
-				elif 'segmentation' == key:
-					seg = sample[key]
-					seg = np.flip(seg, axis=1)
-					sample[key] = seg
-				elif 'segmentation_pseudo' in key:
-					seg_pseudo = sample[key]
-					seg_pseudo = np.flip(seg_pseudo, axis=1)
-					sample[key] = seg_pseudo
+			for key in group_keys(sample, IMAGE) + group_keys(sample, LABEL):
+				sample[key] = np.flip(sample[key], axis=1)
 		return sample
 
 class RandomScale(object):
@@ -132,39 +182,120 @@ class RandomScale(object):
 	def __call__(self, sample):
 		row, col, _ = sample['image'].shape
 		rand_scale = random.random()*(self.scale_r[1] - self.scale_r[0]) + self.scale_r[0]
-		key_list = sample.keys()
-		for key in key_list:
-			if 'image' in key:
-				img = sample[key]
-				img = cv2.resize(img, None, fx=rand_scale, fy=rand_scale, interpolation=cv2.INTER_CUBIC)
-				sample[key] = img
-			elif 'segmentation' == key:
-				seg = sample[key]
-				seg = cv2.resize(seg, None, fx=rand_scale, fy=rand_scale, interpolation=self.seg_interpolation)
-				sample[key] = seg
-			elif 'segmentation_pseudo' in key:
-				seg_pseudo = sample[key]
-				seg_pseudo = cv2.resize(seg_pseudo, None, fx=rand_scale, fy=rand_scale, interpolation=self.seg_interpolation)
-				sample[key] = seg_pseudo
+		# one cv2.resize per group on the stacked buffer
+		for group, interpolation in [(IMAGE, cv2.INTER_CUBIC), (LABEL, self.seg_interpolation)]:
+			keys = group_keys(sample, group)
+			if len(keys) == 0:
+				continue
+			buf, channels = stack_group(sample, keys)
+			if buf.dtype == np.int64:
+				buf = buf.astype(np.int32)
+			buf = cv2.resize(buf, None, fx=rand_scale, fy=rand_scale, interpolation=interpolation)
+			unstack_group(sample, keys, buf, channels)
+		return sample
+
+class RandomScaleCropFlip(object):
+	"""RandomFlip + RandomScale + RandomCrop in a single resampling pass.
+
+	Flip, scale and crop window are sampled first (in the same order as the
+	separate transforms), then only the source region that lands in the crop
+	is resampled: images are resized from the top-left corner up to the end of
+	the window (plus the cubic support), which keeps the cv2.resize sampling
+	grid and so gives the same pixels; label maps are a nearest neighbour
+	gather of the rows / columns cv2.resize INTER_NEAREST picks. The full size
+	rescaled intermediates are never built.
+
+	Images are expected as uint8 (normalize afterwards), the container outside
+	the window is filled with image_fill and 255.
+	"""
+	def __init__(self, scale_r, output_size, flip_t, image_fill=0):
+		self.scale_r = scale_r
+		self.output_size = (output_size, output_size) if isinstance(output_size, int) else output_size
+		self.flip_t = flip_t
+		self.image_fill = image_fill
+
+	def __call__(self, sample):
+		h, w = sample['image'].shape[:2]
+		flip = self.flip_t > 0 and random.random() < self.flip_t
+		if self.scale_r != 1:
+			scale = random.random()*(self.scale_r[1] - self.scale_r[0]) + self.scale_r[0]
+		else:
+			scale = 1.
+		sh, sw = int(round(h*scale)), int(round(w*scale))
+		ch, cw, cont_top, cont_left, img_top, img_left = crop_window(sh, sw, self.output_size)
+
+		# source rows / columns up to the window end, + 3 for the cubic taps
+		h_end = min(h, int(np.ceil((img_top+ch)/scale)) + 3)
+		w_end = min(w, int(np.ceil((img_left+cw)/scale)) + 3)
+		pad = (cont_top, self.output_size[0]-cont_top-ch, cont_left, self.output_size[1]-cont_left-cw)
+		for key in group_keys(sample, IMAGE):
+			img = sample[key]
+			c = img.shape[2]
+			if flip:
+				# the first w_end columns of the flipped image
+				img = cv2.flip(img[:h_end, w-w_end:], 1)
+			if scale != 1:
+				img = cv2.resize(img[:h_end, :w_end], None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+			window = img[img_top:img_top+ch, img_left:img_left+cw].reshape(ch, cw, c)
+			fill = np.tile(self.image_fill, c//3) if np.ndim(self.image_fill) > 0 else np.full(c, self.image_fill)
+			if c <= 4:
+				crop = cv2.copyMakeBorder(window, *pad, cv2.BORDER_CONSTANT, value=fill.tolist()).reshape(self.output_size[0], self.output_size[1], c)
+			else:
+				crop = np.empty((self.output_size[0], self.output_size[1], c), img.dtype)
+				crop[...] = fill
+				crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = window
+			sample[key] = crop
+
+		label_keys = group_keys(sample, LABEL)
+		if len(label_keys) > 0:
+			rows = np.minimum(np.floor(np.arange(img_top, img_top+ch)/scale).astype(np.int64), h-1)
+			cols = np.minimum(np.floor(np.arange(img_left, img_left+cw)/scale).astype(np.int64), w-1)
+			if flip:
+				cols = w - 1 - cols
+			seg, channels = stack_group(sample, label_keys)
+			seg_crop = np.empty((self.output_size[0], self.output_size[1], seg.shape[2]), np.float32)
+			if max(pad) > 0:
+				seg_crop[...] = 255
+			seg_crop[cont_top:cont_top+ch, cont_left:cont_left+cw] = seg[rows][:, cols]
+			unstack_group(sample, label_keys, seg_crop, channels, np.float32)
 		return sample
 
 class ImageNorm(object):
-	"""Randomly scale image"""
+	"""Normalize images as (x/255 - mean) / std, or x/255 without mean/std.
+
+	Writable contiguous float32 images are normalized in place, other images
+	(uint8, float64, views) into a new float32 array.
+	"""
 	def __init__(self, mean=None, std=None):
 		self.mean = mean
 		self.std = std
+		if mean is not None and std is not None:
+			self.scale = (1/(255*np.array(std))).astype(np.float32)
+			self.offset = (-np.array(mean)/np.array(std)).astype(np.float32)
+		else:
+			self.scale = np.full(3, 1/255.0, np.float32)
+			self.offset = np.zeros(3, np.float32)
+		self.row_params = dict()
+
+	def get_row_params(self, width):
+		# scale/offset tiled over a whole image row: the broadcast then runs
+		# over rows of width*3 values instead of the 3 channels of every pixel
+		if width not in self.row_params:
+			self.row_params[width] = (np.tile(self.scale, width), np.tile(self.offset, width))
+		return self.row_params[width]
+
 	def __call__(self, sample):
-		key_list = sample.keys()
-		for key in key_list:
-			if 'image' in key:
-				image = sample[key].astype(np.float32)
-				if self.mean is not None and self.std is not None:
-					image[...,0] = (image[...,0]/255 - self.mean[0]) / self.std[0]
-					image[...,1] = (image[...,1]/255 - self.mean[1]) / self.std[1]
-					image[...,2] = (image[...,2]/255 - self.mean[2]) / self.std[2]
-				else:
-					image /= 255.0
-				sample[key] = image
+		for key in group_keys(sample, IMAGE):
+			image = sample[key]
+			h, w, c = image.shape
+			scale, offset = self.get_row_params(w)
+			if image.dtype == np.float32 and image.flags.writeable and image.flags.c_contiguous:
+				image = image.reshape(h, w*c)
+				image *= scale
+			else:
+				image = np.multiply(image.reshape(h, w*c), scale, dtype=np.float32)
+			image += offset
+			sample[key] = image.reshape(h, w, c)
 		return sample
 
 class Multiscale(object):
@@ -187,13 +318,15 @@ class ToTensor(object):
 	def __call__(self, sample):
 		key_list = sample.keys()
 		for key in key_list:
-			if 'image' in key:
-				image = sample[key].astype(np.float32)
+			if key_group(key) == IMAGE:
+				image = sample[key]
+				if image.dtype != np.uint8:
+					image = image.astype(np.float32)
 				# swap color axis because
 				# numpy image: H x W x C
 				# torch image: C X H X W
 				image = image.transpose((2,0,1))
-				sample[key] = torch.from_numpy(image)
+				sample[key] = torch.from_numpy(np.ascontiguousarray(image))
 				#sample[key] = torch.from_numpy(image.astype(np.float32)/128.0-1.0)
 			elif 'edge' == key:
 				edge = sample['edge']
@@ -1,42 +1,41 @@
 import numpy as np
-import pydensecrf.densecrf as dcrf
-from pydensecrf.utils import unary_from_softmax
+# the CRF implementation is shared with the root project (repo root on sys.path, see the experiment configs)
+from tool import crf
+from tool.crf import CRF_PARAMS, MeanFieldCRF
 
 def dense_crf(probs, img=None, n_classes=21, n_iters=1, scale_factor=1):
-	#probs = np.transpose(probs,(1,2,0)).copy(order='C')
 	c,h,w = probs.shape
 
 	if img is not None:
 		assert(img.shape[1:3] == (h, w))
 		img = np.transpose(img,(1,2,0)).copy(order='C')
 
-	#probs = probs.transpose(2, 0, 1).copy(order='C') # Need a contiguous array.
-
-	d = dcrf.DenseCRF2D(w, h, n_classes) # Define DenseCRF model.
-	
-	unary = unary_from_softmax(probs)
-	unary = np.ascontiguousarray(unary)
-	d.setUnaryEnergy(unary)
-	d.addPairwiseGaussian(sxy=3/scale_factor, compat=3)
 	#d.addPairwiseBilateral(sxy=80/scale_factor, srgb=13, rgbim=np.copy(img), compat=10)
-	d.addPairwiseBilateral(sxy=32/scale_factor, srgb=13, rgbim=np.copy(img), compat=10)
-	Q = d.inference(n_iters)
-
-#	U = -np.log(probs) # Unary potential.
-#	U = U.reshape((n_classes, -1)) # Needs to be flat.
-#	d.setUnaryEnergy(U)
-#	d.addPairwiseGaussian(sxy=sxy_gaussian, compat=compat_gaussian,
-#			kernel=kernel_gaussian, normalization=normalisation_gaussian)
-#	if img is not None:
-#		assert(img.shape[1:3] == (h, w))
-#		img = np.transpose(img,(1,2,0)).copy(order='C')
-#		d.addPairwiseBilateral(sxy=sxy_bilateral, compat=compat_bilateral,
-#				kernel=kernel_bilateral, normalization=normalisation_bilateral,
-#				srgb=srgb_bilateral, rgbim=img)
-#	Q = d.inference(n_iters)
-	preds = np.array(Q, dtype=np.float32).reshape((n_classes, h, w))
-	#return np.expand_dims(preds, 0)
-	return preds
+	return crf.crf_inference(img, probs=probs, t=n_iters, n_labels=n_classes, scale_factor=scale_factor, **CRF_PARAMS['dense_crf'])
+
+def dense_crf_from_deeplabv2(probs, img=None, n_classes=21, n_iters=10, scale_factor=1):
+	c,h,w = probs.shape
+
+	if img is not None:
+		assert(img.shape[1:3] == (h, w))
+		img = np.transpose(img,(1,2,0)).copy(order='C')
+
+	return crf.crf_inference(img, probs=probs, t=n_iters, n_labels=n_classes, scale_factor=scale_factor, **CRF_PARAMS['deeplabv2'])
+
+def CRFPool(num_workers=0, crf_func=dense_crf, argmax=True, **kwargs):
+	"""Run a CRF function (dense_crf, dense_crf_from_deeplabv2, ...) in worker processes.
+
+	A tool.crf.CRFPool: submit(probs, img) returns a multiprocessing AsyncResult
+	of the C x H x W marginals, or of their argmax with argmax=True; single_gpu_test
+	accepts it as the result of collect_func. With num_workers = 0 the CRF runs in place.
+
+	Args:
+		num_workers(int): number of processes, create the pool before cuda is initialized
+		crf_func(function): crf_func(probs, img, **kwargs)
+		argmax(bool): return the label map instead of the marginals
+		kwargs: passed to crf_func (n_iters, scale_factor, ...)
+	"""
+	return crf.CRFPool(num_workers, argmax=argmax, func=crf_func, **kwargs)
 
 def pro_crf(p, img, itr):
 	C, H, W = p.shape
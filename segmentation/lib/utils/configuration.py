@@ -13,12 +13,17 @@ class Configuration():
 		self.__check()
 		
 	def __check(self):
-		if not torch.cuda.is_available():
-			raise ValueError('config.py: cuda is not avalable')
-		if self.GPUS == 0:
-			raise ValueError('config.py: the number of GPU is 0')
-		if self.GPUS != torch.cuda.device_count():
-			raise ValueError('config.py: GPU number is not matched')
+		# GPUS = 0 runs everything on the cpu
+		if self.GPUS > 0:
+			if not torch.cuda.is_available():
+				raise ValueError('config.py: cuda is not avalable')
+			if self.GPUS != torch.cuda.device_count():
+				raise ValueError('config.py: GPU number is not matched')
+			self.DEVICE = torch.device('cuda', 0)
+		else:
+			self.DEVICE = torch.device('cpu')
+			if getattr(self, 'CPU_THREADS', 0) > 0:
+				torch.set_num_threads(self.CPU_THREADS)
 		if not os.path.isdir(self.LOG_DIR):
 			os.makedirs(self.LOG_DIR)
 		elif self.clear:
@@ -0,0 +1,30 @@
+# ----------------------------------------
+# Offline label conversion: writes the remapped ground truth of every
+# image as a uint8 png into cfg.DATA_SEG_CACHE, the datasets then read
+# those directly instead of remapping labels in every sample
+#
+# run from an experiment folder, with its config.py:
+#	python ../../lib/utils/convert_labels.py
+# or, with lib on PYTHONPATH:
+#	python -m utils.convert_labels
+# ----------------------------------------
+
+import os
+import sys
+
+def convert_labels(cfg, periods=('train', 'val')):
+	from datasets.generateData import generate_dataset
+	if not cfg.DATA_SEG_CACHE:
+		raise ValueError('convert_labels: cfg.DATA_SEG_CACHE can not be empty')
+	for period in periods:
+		dataset = generate_dataset(cfg, period=period, transform='none')
+		print('%s: %d label maps to %s'%(period, len(dataset), cfg.DATA_SEG_CACHE))
+		dataset.export_segmentation(cfg.DATA_SEG_CACHE, cfg.DATA_WORKERS)
+
+if __name__ == '__main__':
+	# the experiment's config.py is in the working directory (its paths are relative to it)
+	# and puts lib on sys.path; the script's own folder must not shadow top level modules
+	sys.path[0] = os.getcwd()
+	from config import config_dict
+	from utils.configuration import Configuration
+	convert_labels(Configuration(config_dict, False))
@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+import torch
 
 def pseudo_erode(label, num, t=1):
 	label_onehot = onehot(label, num)
@@ -11,16 +12,15 @@ def pseudo_erode(label, num, t=1):
 	return label
 	
 
-def onehot(label, num):
+def onehot(label, num, dtype=np.float64):
 	num = int(num)
 	m = label.astype(np.int32)
-	one_hot = np.eye(num)[m]
+	one_hot = np.eye(num, dtype=dtype)[m]
 	return one_hot
 
 def seg2cls(label, num):
-	cls = np.zeros(num)
-	index = np.unique(label)
-	cls[index] = 1
+	# presence vector of the labels in label (all < num), num x 1 x 1
+	cls = (np.bincount(label.reshape(-1).astype(np.int64), minlength=num)[:num] > 0).astype(np.float64)
 	#cls[0] = 0
 	cls = cls.reshape((num,1,1))
 	return cls
@@ -33,8 +33,42 @@ def gamma_correction(img):
 	res_img = cv2.LUT(img, lookUpTable)
 	return res_img
 
+def label_lut(remap, size=256):
+	# precompute a label remapping: remap (an in-place, pixel-wise function on a
+	# label array, e.g. the seg[seg==i] = j loops of the datasets) is run once on
+	# every possible label value, so chained assignments give the same result
+	lut = np.arange(size, dtype=np.int64)
+	remap(lut)
+	return lut.astype(np.uint8)
+
+def apply_lut(seg, lut):
+	# remap a label map with a lut from label_lut in a single pass
+	if seg.dtype == np.uint8 and lut.shape[0] == 256:
+		return cv2.LUT(seg, lut)
+	return np.take(lut, seg, mode='clip')
+
+def img_norm_batch(inputs, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+	# normalize a uint8 N x 3 x H x W tensor on its device (DATA_UINT8),
+	# float inputs were already normalized by ImageNorm and are returned as is
+	if inputs.dtype != torch.uint8:
+		return inputs
+	mean = torch.tensor(mean, dtype=torch.float32, device=inputs.device).view(1,3,1,1)
+	std = torch.tensor(std, dtype=torch.float32, device=inputs.device).view(1,3,1,1)
+	return (inputs.float()/255 - mean) / std
+
+def img_denorm_batch(inputs, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+	# inverse of img_norm_batch on the device of inputs: N x 3 x H x W float RGB in 0-255,
+	# uint8 inputs (DATA_UINT8) are only converted
+	if inputs.dtype == torch.uint8:
+		return inputs.float()
+	mean = torch.tensor(mean, dtype=torch.float32, device=inputs.device).view(1,3,1,1)
+	std = torch.tensor(std, dtype=torch.float32, device=inputs.device).view(1,3,1,1)
+	return ((inputs.float()*std + mean)*255).clamp(0, 255)
+
 def img_denorm(inputs, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), mul=True):
 	inputs = np.ascontiguousarray(inputs)
+	if inputs.dtype == np.uint8:
+		return inputs if mul else inputs/255.0
 	if inputs.ndim == 3:
 		inputs[0,:,:] = (inputs[0,:,:]*std[0] + mean[0])
 		inputs[1,:,:] = (inputs[1,:,:]*std[1] + mean[1])
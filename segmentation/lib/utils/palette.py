@@ -0,0 +1,32 @@
+import numpy as np
+
+def bitwise_palette(N):
+	"""The PASCAL VOC colormap as a N x 3 uint8 array
+
+	Bit 3j, 3j+1, 3j+2 of the label go to bit 7-j of r, g, b.
+	"""
+	label = np.arange(N, dtype=np.int64)
+	cmap = np.zeros((N, 3), dtype=np.int64)
+	for j in range(7):
+		for channel in range(3):
+			cmap[:, channel] |= ((label >> (3*j+channel)) & 1) << (7-j)
+	return cmap.astype(np.uint8)
+
+def palette_lut(label2color, size=256):
+	"""Precompute a size x 3 uint8 palette from a per pixel label -> color function
+
+	label2color is run once on every label value, so any existing colormap
+	function (bit twiddling, per class masks) gives exactly the same colors.
+	"""
+	label = np.arange(size).reshape(1, size)
+	return np.ascontiguousarray(label2color(label)[0], dtype=np.uint8)
+
+def colorize(label, palette):
+	"""Color a label map with a single fancy index into palette, H x W -> H x W x 3
+
+	With a 256 entry palette the label is cast to uint8 first, as the colormap
+	functions the palettes are built from do.
+	"""
+	if palette.shape[0] == 256:
+		label = label.astype(np.uint8)
+	return palette[label]
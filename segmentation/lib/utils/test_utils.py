@@ -1,31 +1,172 @@
-import time
+import os
 import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from collections import deque
 from tqdm import tqdm
+from tool.torchutils import BucketBatchSampler
 
-def single_gpu_test(model, dataloader, prepare_func, inference_func, collect_func, save_step_func=None):
+def cv2_resize(image, rate):
+	# bicubic resize of a N x C x H x W tensor matching
+	# cv2.resize(img, None, fx=rate, fy=rate, interpolation=cv2.INTER_CUBIC):
+	# output size round(h*rate) and source coordinates (x+0.5)/rate-0.5
+	n, c, h, w = image.size()
+	oh, ow = int(round(h*rate)), int(round(w*rate))
+	ys = (torch.arange(oh, dtype=torch.float32, device=image.device)+0.5)/rate
+	xs = (torch.arange(ow, dtype=torch.float32, device=image.device)+0.5)/rate
+	grid_y = (ys/h*2-1).view(oh, 1).expand(oh, ow)
+	grid_x = (xs/w*2-1).view(1, ow).expand(oh, ow)
+	grid = torch.stack([grid_x, grid_y], dim=-1).unsqueeze(0).expand(n, oh, ow, 2)
+	return F.grid_sample(image.float(), grid, mode='bicubic', padding_mode='border', align_corners=False)
+
+def multiscale_flip(image, rate_list, flip):
+	# device side version of transform.Multiscale (TEST_LAZY_MULTISCALE):
+	# the scales of image, each followed by its horizontal flip if flip
+	image_msf = []
+	for rate in rate_list:
+		image_rate = image if rate == 1 else cv2_resize(image, rate)
+		image_msf.append(image_rate)
+		if flip:
+			image_msf.append(torch.flip(image_rate, [3]))
+	return image_msf
+
+class DevicePrefetcher():
+	# moves the image tensors of the next sample to the device on a side cuda
+	# stream while the current one is processed; a plain iterator on the cpu
+	def __init__(self, dataloader, device):
+		self.dataloader = dataloader
+		self.device = device
+		self.stream = torch.cuda.Stream(device) if device.type == 'cuda' else None
+
+	def __len__(self):
+		return len(self.dataloader)
+
+	def _to_device(self, sample, main_stream):
+		for key in sample.keys():
+			if 'image' in key and torch.is_tensor(sample[key]):
+				sample[key] = sample[key].to(self.device, non_blocking=True)
+				# allocated on the side stream but consumed on the main one
+				sample[key].record_stream(main_stream)
+		return sample
+
+	def __iter__(self):
+		if self.stream is None:
+			for sample in self.dataloader:
+				yield sample
+			return
+		main_stream = torch.cuda.current_stream(self.device)
+		next_sample = None
+		for sample in self.dataloader:
+			with torch.cuda.stream(self.stream):
+				sample = self._to_device(sample, main_stream)
+			if next_sample is not None:
+				yield next_sample
+			main_stream.wait_stream(self.stream)
+			next_sample = sample
+		if next_sample is not None:
+			yield next_sample
+
+def batched_inference(model, image_msf, inference_func):
+	# consecutive views of the same size (e.g. a scale and its flip) are
+	# concatenated into one batch; returns the outputs in the order of image_msf
+	result_list = []
+	i = 0
+	while i < len(image_msf):
+		j = i + 1
+		while j < len(image_msf) and image_msf[j].size() == image_msf[i].size():
+			j += 1
+		result = inference_func(model, torch.cat(image_msf[i:j], dim=0))
+		result_list.extend(torch.split(result, [img.size(0) for img in image_msf[i:j]], dim=0))
+		i = j
+	return result_list
+
+def size_batch_sampler(dataset, batch_size):
+	# TEST_BATCHES > 1: batches of images of the same size (dataset.image_size), so that the
+	# default collate can stack them; None (plain batch_size=1 loader) for one image per batch
+	if batch_size <= 1:
+		return None
+	return BucketBatchSampler([tuple(dataset.image_size(i)) for i in range(len(dataset))], batch_size)
+
+def split_sample(sample, i):
+	# the i-th image of a collated sample, as a batch of one
+	sample_i = {}
+	for key, value in sample.items():
+		if torch.is_tensor(value) and value.dim() > 0:
+			sample_i[key] = value[i:i+1]
+		elif isinstance(value, (list, tuple)):
+			sample_i[key] = [value[i]]
+		else:
+			sample_i[key] = value
+	return sample_i
+
+def single_gpu_test(model, dataloader, prepare_func, inference_func, collect_func, save_step_func=None, metric=None, max_pending=16):
+	# metric: optional datasets.metric.ConfusionMatrix, updated with every
+	# prediction and the sample's ground truth, the running mIoU goes to the bar
+	# collect_func may return a multiprocessing AsyncResult (utils.DenseCRF.CRFPool):
+	# results are then resolved in order, up to max_pending images behind the network
 	model.eval()
-	n_gpus = torch.cuda.device_count()
-	#assert n_gpus == 1
+	device = next(model.parameters()).device
 	collect_list = []
+	pending = deque()
 	total_num = len(dataloader)
+
+	def finish(result_item, name, segmentation):
+		if hasattr(result_item, 'ready'):
+			result_item = result_item.get()
+		result_sample = {'predict': result_item, 'name':name}
+		if segmentation is not None:
+			metric.update(result_item, segmentation)
+		if save_step_func is not None:
+			save_step_func(result_sample)
+		else:
+			collect_list.append(result_sample)
+
 	with tqdm(total=total_num) as pbar:
 		with torch.no_grad():
-			for i_batch, sample in enumerate(dataloader):
+			for i_batch, sample in enumerate(DevicePrefetcher(dataloader, device)):
 				name = sample['name']
-				image_msf = prepare_func(sample)
-				result_list = []
-				for img in image_msf:
-					result = inference_func(model, img.cuda())	
-					result_list.append(result)
-				result_item = collect_func(result_list, sample)
-				result_sample = {'predict': result_item, 'name':name[0]}
-				#print('%d/%d'%(i_batch,len(dataloader)))
+				image_msf = [img.to(device) for img in prepare_func(sample)]
+				result_msf = batched_inference(model, image_msf, inference_func)
+				# several images per batch (TEST_BATCHES > 1, same sized images from size_batch_sampler)
+				for i in range(len(name)):
+					if len(name) > 1:
+						result_list = [result[i:i+1] for result in result_msf]
+						sample_i = split_sample(sample, i)
+					else:
+						result_list, sample_i = list(result_msf), sample
+					result_item = collect_func(result_list, sample_i)
+					segmentation = None
+					if metric is not None and 'segmentation' in sample_i:
+						segmentation = sample_i['segmentation'][0].numpy()
+					pending.append((result_item, name[i], segmentation))
+				while len(pending) > 0 and (len(pending) > max_pending or not hasattr(pending[0][0], 'ready') or pending[0][0].ready()):
+					finish(*pending.popleft())
 				pbar.set_description('Processing')
+				if metric is not None:
+					pbar.set_postfix(mIoU='%.2f'%(metric.miou()*100))
 				pbar.update(1)
-				time.sleep(0.001)
-
-				if save_step_func is not None:
-					save_step_func(result_sample)
-				else:
-					collect_list.append(result_sample)
+			while len(pending) > 0:
+				finish(*pending.popleft())
 	return collect_list
+
+def shard_device(rank, gpus, cpu_threads=0, num_shards=1):
+	# the device of shard rank: shards are spread round robin over the gpus,
+	# with gpus = 0 every shard is a cpu process with its share of the cores
+	if gpus > 0:
+		device = torch.device('cuda', rank % gpus)
+		torch.cuda.set_device(device)
+		return device
+	if cpu_threads <= 0:
+		cpu_threads = max(1, (os.cpu_count() or 1) // num_shards)
+	torch.set_num_threads(cpu_threads)
+	return torch.device('cpu')
+
+def sharded_test(test_shard_func, num_shards, args=()):
+	# runs test_shard_func(rank, num_shards, *args) in num_shards spawned
+	# processes and waits for all of them; test_shard_func must be a module
+	# level function (it is pickled), each shard builds its own model replica
+	# and writes its own predictions, the caller evaluates afterwards
+	if num_shards <= 1:
+		test_shard_func(0, 1, *args)
+		return
+	mp.spawn(test_shard_func, args=(num_shards,)+tuple(args), nprocs=num_shards, join=True)
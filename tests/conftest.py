@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the root packages (tool, voc12, ...) and the segmentation library (utils, datasets, ...),
+# the library first: both trees have a utils package
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'segmentation', 'lib'))
@@ -0,0 +1,37 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from tool.pyutils import AsyncWriter
+
+
+def test_writes_png_and_npy(tmp_path):
+    label = np.random.RandomState(0).randint(0, 21, (32, 48)).astype(np.uint8)
+    with AsyncWriter(num_threads=2, png_compression=1) as writer:
+        writer.imwrite(str(tmp_path / 'a.png'), label)
+        writer.save_npy(str(tmp_path / 'a.npy'), label)
+    assert np.array_equal(cv2.imread(str(tmp_path / 'a.png'), cv2.IMREAD_UNCHANGED), label)
+    assert np.array_equal(np.load(str(tmp_path / 'a.npy')), label)
+
+
+def test_flush_raises_write_error(tmp_path):
+    writer = AsyncWriter(num_threads=1)
+    writer.imwrite(os.path.join(str(tmp_path), 'missing', 'a.png'), np.zeros((4, 4), np.uint8))
+    with pytest.raises(IOError):
+        writer.flush()
+    writer.close()
+
+
+def test_exit_prints_write_error(tmp_path, capsys):
+    writer = AsyncWriter(num_threads=1)
+    writer.imwrite(os.path.join(str(tmp_path), 'missing', 'a.png'), np.zeros((4, 4), np.uint8))
+    writer._AsyncWriter__close_at_exit()
+    assert writer.closed
+    assert 'could not write' in capsys.readouterr().err
+
+
+def test_segmentation_datasets_share_writer():
+    BaseDataset = pytest.importorskip('datasets.BaseDataset')
+    assert BaseDataset.AsyncWriter is AsyncWriter
@@ -0,0 +1,37 @@
+import torch
+
+from tool.torchutils import BatchAugment
+
+N = 20000
+
+
+def _check_range(values, low, high):
+    assert values.min().item() >= low and values.max().item() <= high
+    # both ends of the range are reached
+    assert values.min().item() < low + 0.01 * (high - low)
+    assert values.max().item() > high - 0.01 * (high - low)
+
+
+def test_jitter_factor_ranges():
+    torch.manual_seed(0)
+    aug = BatchAugment((0.5, 0.5, 0.5), (0.5, 0.5, 0.5), brightness=0.3, contrast=0.4, saturation=0.5, hue=0.1)
+    for amount in (aug.brightness, aug.contrast, aug.saturation):
+        _check_range(aug._factor(N, amount, 'cpu'), 1. - amount, 1. + amount)
+    _check_range(aug._shift(N, aug.hue, 'cpu'), -aug.hue, aug.hue)
+
+
+def test_jitter_factor_clamped_at_zero():
+    torch.manual_seed(0)
+    _check_range(BatchAugment._factor(N, 1.5, 'cpu'), 0., 2.5)
+
+
+def test_hue_rotates_both_ways():
+    # a pure red image: a negative hue shift adds blue, a positive one green
+    torch.manual_seed(0)
+    aug = BatchAugment((0., 0., 0.), (1., 1., 1.), brightness=0, contrast=0, saturation=0, hue=0.1, hflip=False)
+    img = torch.zeros(256, 4, 4, 3, dtype=torch.uint8)
+    img[..., 0] = 255
+    box = torch.tensor([[0, 4, 0, 4]]).repeat(256, 1)
+    out = aug(img, box)
+    assert (out[:, 1].mean(dim=(1, 2)) > 0.05).any()
+    assert (out[:, 2].mean(dim=(1, 2)) > 0.05).any()
@@ -0,0 +1,41 @@
+import json
+import os
+import types
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('pycocotools')
+
+
+def _cfg(root_dir, **kwargs):
+    cfg = dict(ROOT_DIR=str(root_dir), DATA_YEAR=2014, MODEL_NUM_CLASSES=21, TEST_MULTISCALE=[1.0],
+               DATA_RANDOMROTATION=0, DATA_RANDOMSCALE=1, DATA_RANDOMFLIP=0, DATA_RANDOM_H=0,
+               DATA_RANDOM_S=0, DATA_RANDOM_V=0, DATA_RANDOMGAUSSIAN=0, DATA_RANDOMCROP=0)
+    cfg.update(kwargs)
+    return types.SimpleNamespace(**cfg)
+
+
+@pytest.fixture
+def coco_root(tmp_path):
+    coco = tmp_path / 'data' / 'MSCOCO'
+    os.makedirs(coco / 'images' / 'train2014')
+    os.makedirs(coco / 'annotations')
+    Image.fromarray(np.zeros((20, 30, 3), np.uint8)).save(coco / 'images' / 'train2014' / 'a.jpg')
+    dataset = {
+        'images': [{'id': 7, 'file_name': 'a.jpg', 'height': 20, 'width': 30}],
+        'annotations': [{'id': 1, 'image_id': 7, 'category_id': 3, 'iscrowd': 0, 'area': 100, 'bbox': [5, 5, 10, 10],
+                         'segmentation': [[5, 5, 15, 5, 15, 15, 5, 15]]}],
+        'categories': [{'id': 1, 'name': 'a'}, {'id': 3, 'name': 'b'}],
+    }
+    with open(coco / 'annotations' / 'instances_train2014.json', 'w') as f:
+        json.dump(dataset, f)
+    return tmp_path
+
+
+def test_coco_index_mode_matches_api(coco_root):
+    from datasets.COCODataset import COCOSmtSegDataset
+    by_api = COCOSmtSegDataset(_cfg(coco_root), 'train')[0]['segmentation'].numpy()
+    by_index = COCOSmtSegDataset(_cfg(coco_root, DATA_COCO_INDEX=True), 'train')[0]['segmentation'].numpy()
+    assert by_api.max() == 2
+    assert np.array_equal(by_api, by_index)
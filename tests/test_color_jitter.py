@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+import PIL.Image
+import pytest
+import torch
+import torchvision
+
+from tool.imutils import ColorJitter
+
+
+@pytest.fixture
+def image():
+    # smooth fixed RGB image with saturated and grey regions
+    noise = np.random.RandomState(0).randint(0, 256, (24, 32, 3)).astype(np.uint8)
+    return PIL.Image.fromarray(cv2.resize(noise, (320, 240), interpolation=cv2.INTER_LINEAR))
+
+
+def _diff(params, image, seeds=range(8)):
+    fast, ref = ColorJitter(**params), torchvision.transforms.ColorJitter(**params)
+    diffs = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        out = fast(image)
+        torch.manual_seed(seed)
+        diffs.append(np.abs(out.astype(np.int32) - np.asarray(ref(image), dtype=np.int32)))
+    return np.stack(diffs)
+
+
+@pytest.mark.parametrize('params', [
+    dict(hue=0.5),
+    dict(brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1),
+])
+def test_matches_torchvision(params, image):
+    diff = _diff(params, image)
+    assert diff.max() <= 8
+    assert diff.mean() < 0.02
+    assert (diff > 0).mean() < 0.005
+
+
+def test_lut_params_exact(image):
+    assert _diff(dict(brightness=0.3, contrast=0.3, saturation=0.3), image).max() == 0
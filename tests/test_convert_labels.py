@@ -0,0 +1,27 @@
+import types
+import pytest
+
+from utils import convert_labels
+
+
+def test_convert_labels(monkeypatch):
+    exported = []
+
+    class _Dataset():
+        def __init__(self, period):
+            self.period = period
+
+        def __len__(self):
+            return 2
+
+        def export_segmentation(self, folder_path, num_workers):
+            exported.append((self.period, folder_path, num_workers))
+
+    import datasets.generateData
+    monkeypatch.setattr(datasets.generateData, 'generate_dataset', lambda cfg, period, transform: _Dataset(period))
+    cfg = types.SimpleNamespace(DATA_SEG_CACHE='cache', DATA_WORKERS=3)
+    convert_labels.convert_labels(cfg)
+    assert exported == [('train', 'cache', 3), ('val', 'cache', 3)]
+
+    with pytest.raises(ValueError):
+        convert_labels.convert_labels(types.SimpleNamespace(DATA_SEG_CACHE=None, DATA_WORKERS=3))
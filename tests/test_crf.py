@@ -0,0 +1,102 @@
+import sys
+import types
+import numpy as np
+import pytest
+
+
+class _FakeDenseCRF2D():
+    # pydensecrf.densecrf.DenseCRF2D stand-in: inference returns softmax(-unary)
+    def __init__(self, w, h, n_labels):
+        self.shape = (n_labels, h * w)
+
+    def setUnaryEnergy(self, unary):
+        assert unary.shape == self.shape
+        self.unary = unary
+
+    def addPairwiseGaussian(self, **kwargs):
+        pass
+
+    def addPairwiseBilateral(self, rgbim=None, **kwargs):
+        assert rgbim.dtype == np.uint8 and rgbim.shape[2] == 3
+
+    def inference(self, n_iters):
+        e = np.exp(-self.unary - (-self.unary).max(0))
+        return e / e.sum(0)
+
+
+@pytest.fixture
+def pydensecrf(monkeypatch):
+    try:
+        import pydensecrf.densecrf  # noqa: F401
+        return
+    except ImportError:
+        pass
+    package = types.ModuleType('pydensecrf')
+    densecrf = types.ModuleType('pydensecrf.densecrf')
+    densecrf.DenseCRF2D = _FakeDenseCRF2D
+    utils = types.ModuleType('pydensecrf.utils')
+    utils.unary_from_softmax = lambda probs: -np.log(np.clip(probs, 1e-5, 1)).reshape(probs.shape[0], -1).astype(np.float32)
+    utils.unary_from_labels = lambda labels, n_labels, gt_prob=0.5, zero_unsure=True: \
+        -np.log(np.where(np.eye(n_labels, dtype=bool)[labels.reshape(-1)].T, gt_prob,
+                         (1 - gt_prob) / (n_labels - 1))).astype(np.float32)
+    package.densecrf, package.utils = densecrf, utils
+    monkeypatch.setitem(sys.modules, 'pydensecrf', package)
+    monkeypatch.setitem(sys.modules, 'pydensecrf.densecrf', densecrf)
+    monkeypatch.setitem(sys.modules, 'pydensecrf.utils', utils)
+
+
+def _sample(n_classes=3, h=12, w=16):
+    rng = np.random.RandomState(0)
+    probs = rng.rand(n_classes, h, w).astype(np.float32)
+    img = rng.randint(0, 256, (3, h, w)).astype(np.uint8)
+    return probs / probs.sum(0, keepdims=True), img
+
+
+@pytest.mark.parametrize('scale_factor', [1, 2])
+def test_dense_crf(pydensecrf, scale_factor):
+    from utils.DenseCRF import dense_crf, dense_crf_from_deeplabv2
+    probs, img = _sample()
+    for func in (dense_crf, dense_crf_from_deeplabv2):
+        Q = func(probs, img, n_classes=3, scale_factor=scale_factor)
+        assert Q.shape == probs.shape and Q.dtype == np.float32
+
+
+def test_crf_pool(pydensecrf):
+    from utils.DenseCRF import CRFPool
+    probs, img = _sample()
+    pool = CRFPool(0, n_classes=3)
+    preds = pool.map([(probs, img), (probs[:, :8], img[:, :8])])
+    pool.close()
+    assert preds[0].shape == (12, 16) and preds[1].shape == (8, 16)
+
+
+def test_crf_pool_workers(pydensecrf):
+    from utils.DenseCRF import CRFPool, dense_crf_from_deeplabv2
+    probs, img = _sample()
+    expected = np.argmax(dense_crf_from_deeplabv2(probs, img, n_classes=3), axis=0)
+    with CRFPool(2, dense_crf_from_deeplabv2, n_classes=3) as pool:
+        results = [pool.submit(probs, img) for _ in range(3)]
+        assert all(np.array_equal(r.get(), expected) for r in results)
+
+
+def test_root_crf_pool_labels(pydensecrf):
+    from tool import crf
+    rng = np.random.RandomState(0)
+    img = rng.randint(0, 256, (12, 16, 3)).astype(np.uint8)
+    labels = rng.randint(0, 3, (12, 16)).astype(np.uint8)
+    with crf.CRFPool(0, argmax=True, n_labels=3, **crf.CRF_PARAMS['label']) as pool:
+        pred, = pool.map([dict(img=img, labels=labels)])
+    assert pred.dtype == np.uint8 and pred.shape == labels.shape
+
+
+def test_mean_field_crf_batch():
+    import torch
+    from utils.DenseCRF import MeanFieldCRF, CRF_PARAMS
+    probs = torch.softmax(torch.randn(2, 4, 20, 24), dim=1)
+    img = torch.randint(0, 256, (2, 3, 20, 24)).float()
+    for scale_factor in (1, 2):
+        model = MeanFieldCRF(5, scale_factor, **CRF_PARAMS['deeplabv2'])
+        Q = model(probs, img)
+        assert Q.shape == probs.shape
+        assert torch.allclose(Q.sum(1), torch.ones(2, 20, 24), atol=1e-5)
+        assert torch.allclose(Q[1:], model(probs[1:], img[1:]), atol=1e-5)
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+from tool import torchutils
+
+
+def _transition_matrix(n=64, density=0.1):
+    torch.manual_seed(0)
+    aff = torch.rand(n, n) * (torch.rand(n, n) < density)
+    aff = aff + aff.t() + torch.eye(n)
+    return torchutils.get_transition_matrix(aff, 8), torchutils.get_transition_matrix(aff.to_sparse(), 8)
+
+
+@pytest.mark.parametrize('mode', ['square', 'power'])
+@pytest.mark.parametrize('tol', [0., 1e-3])
+def test_sparse_matches_dense(mode, tol):
+    dense, sparse = _transition_matrix()
+    cam = torch.rand(3, dense.size(0))
+    cam_dense, n_dense = torchutils.random_walk(cam, dense, 5, tol=tol, mode=mode)
+    cam_sparse, n_sparse = torchutils.random_walk(cam, sparse, 5, tol=tol, mode=mode)
+    assert n_sparse == n_dense
+    assert torch.allclose(cam_sparse, cam_dense, atol=1e-5)
+
+
+def test_square_is_matrix_power():
+    dense, sparse = _transition_matrix()
+    cam = torch.rand(3, dense.size(0))
+    expected = cam @ torch.matrix_power(dense.double(), 16).float()
+    for trans_mat in (dense, sparse):
+        cam_rw, n_iters = torchutils.random_walk(cam, trans_mat, 4)
+        assert n_iters == 4
+        assert torch.allclose(cam_rw, expected, atol=1e-4)
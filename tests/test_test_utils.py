@@ -0,0 +1,50 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from utils.test_utils import single_gpu_test, size_batch_sampler
+
+SIZES = [(20, 30), (24, 16), (20, 30), (24, 16), (18, 18)]
+
+
+class _SizedDataset(Dataset):
+    def __len__(self):
+        return len(SIZES)
+
+    def image_size(self, idx):
+        return SIZES[idx]
+
+    def __getitem__(self, idx):
+        h, w = SIZES[idx]
+        image = torch.arange(3 * h * w, dtype=torch.float32).view(3, h, w) * (idx + 1)
+        return {'image': image, 'name': 'img%d' % idx, 'row': h, 'col': w}
+
+
+def _run(batch_size):
+    dataset = _SizedDataset()
+    dataloader = DataLoader(dataset, batch_sampler=size_batch_sampler(dataset, batch_size))
+    torch.manual_seed(0)
+    model = torch.nn.Conv2d(3, 2, 1)
+    batch_sizes = []
+
+    def prepare_func(sample):
+        batch_sizes.append(len(sample['name']))
+        return [sample['image']]
+
+    def collect_func(result_list, sample):
+        assert result_list[0].size(0) == 1 and sample['image'].size(0) == 1
+        return torch.argmax(result_list[0][0], dim=0).numpy()
+
+    results = single_gpu_test(model, dataloader, prepare_func=prepare_func, inference_func=lambda m, img: m(img),
+                              collect_func=collect_func)
+    return {r['name']: r['predict'] for r in results}, batch_sizes
+
+
+def test_batches_of_different_sizes():
+    single, _ = _run(1)
+    batched, batch_sizes = _run(2)
+    assert sorted(batch_sizes) == [1, 2, 2]
+    assert sorted(batched) == sorted(single) == ['img%d' % i for i in range(len(SIZES))]
+    for i, size in enumerate(SIZES):
+        assert batched['img%d' % i].shape == size
+        assert np.array_equal(batched['img%d' % i], single['img%d' % i])
@@ -0,0 +1,32 @@
+import numpy as np
+
+from datasets.transform import ImageNorm
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+
+def _reference(image):
+    return (image.astype(np.float64) / 255 - np.array(MEAN)) / np.array(STD)
+
+
+def test_image_norm_dtypes():
+    image = np.random.RandomState(0).randint(0, 256, (7, 9, 3)).astype(np.uint8)
+    expected = _reference(image)
+    for dtype in (np.uint8, np.float32, np.float64):
+        out = ImageNorm(MEAN, STD)({'image': image.astype(dtype)})['image']
+        assert out.dtype == np.float32 and out.shape == image.shape
+        assert np.allclose(out, expected, atol=1e-5)
+
+
+def test_image_norm_float32_in_place():
+    image = np.random.RandomState(0).randint(0, 256, (7, 9, 3)).astype(np.float32)
+    expected = _reference(image)
+    out = ImageNorm(MEAN, STD)({'image': image})['image']
+    assert np.shares_memory(out, image)
+    assert np.allclose(image, expected, atol=1e-5)
+
+
+def test_image_norm_without_mean_std():
+    image = np.full((2, 3, 3), 51, np.uint8)
+    assert np.allclose(ImageNorm()({'image': image})['image'], 0.2)
@@ -0,0 +1,242 @@
+import functools
+import math
+import multiprocessing
+import numpy as np
+import cv2
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# pairwise parameters of the CRFs used in the project
+CRF_PARAMS = {
+    # imutils.crf_inference, visualization.dense_crf, aff_prepare.py
+    'cam': dict(pos_sxy=3, pos_compat=3, bi_sxy=80, bi_srgb=13, bi_compat=10),
+    # contrast_infer.py --out_crf
+    'label': dict(pos_sxy=3, pos_compat=3, bi_sxy=50, bi_srgb=5, bi_compat=10),
+    # segmentation utils.DenseCRF.dense_crf
+    'dense_crf': dict(pos_sxy=3, pos_compat=3, bi_sxy=32, bi_srgb=13, bi_compat=10),
+    # DeepLab v2 post-processing (utils.DenseCRF.dense_crf_from_deeplabv2)
+    'deeplabv2': dict(pos_sxy=1, pos_compat=3, bi_sxy=67, bi_srgb=3, bi_compat=4),
+}
+
+
+def _resize(arr, size, interpolation):
+    # cv2.resize of a C x H x W array, resized 4 channels at a time (INTER_AREA takes at most 4)
+    out = [cv2.resize(np.ascontiguousarray(arr[i:i + 4].transpose(1, 2, 0)), size, interpolation=interpolation)
+           for i in range(0, arr.shape[0], 4)]
+    out = [o[:, :, np.newaxis] if o.ndim == 2 else o for o in out]
+    return np.concatenate(out, axis=2).transpose(2, 0, 1)
+
+
+def crf_inference(img, probs=None, labels=None, t=10, n_labels=21, gt_prob=0.7, scale_factor=1,
+                  pos_sxy=3, pos_compat=3, bi_sxy=80, bi_srgb=13, bi_compat=10):
+    """Dense CRF on a H x W x 3 uint8 image, the unary is either from probs (n_labels x H x W)
+    or from a H x W label map (gt_prob, as pydensecrf.utils.unary_from_labels).
+
+    scale_factor > 1 runs the CRF on the image, probs / labels downsampled by scale_factor, with
+    the spatial standard deviations divided by scale_factor, and upsamples the result bilinearly.
+
+    Returns the n_labels x H x W float32 marginals.
+    """
+    import pydensecrf.densecrf as dcrf
+    from pydensecrf.utils import unary_from_softmax, unary_from_labels
+
+    h, w = img.shape[:2]
+    if scale_factor != 1:
+        size = (max(1, int(round(w / scale_factor))), max(1, int(round(h / scale_factor))))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        if probs is not None:
+            probs = _resize(probs.astype(np.float32), size, cv2.INTER_AREA)
+        else:
+            labels = cv2.resize(labels, size, interpolation=cv2.INTER_NEAREST)
+    ch, cw = img.shape[:2]
+
+    d = dcrf.DenseCRF2D(cw, ch, n_labels)
+    if probs is not None:
+        unary = unary_from_softmax(probs)
+    else:
+        unary = unary_from_labels(labels, n_labels, gt_prob=gt_prob, zero_unsure=False)
+    d.setUnaryEnergy(np.ascontiguousarray(unary))
+    d.addPairwiseGaussian(sxy=pos_sxy / scale_factor, compat=pos_compat)
+    d.addPairwiseBilateral(sxy=bi_sxy / scale_factor, srgb=bi_srgb, rgbim=np.ascontiguousarray(img), compat=bi_compat)
+    Q = np.array(d.inference(t), dtype=np.float32).reshape((n_labels, ch, cw))
+
+    if scale_factor != 1:
+        Q = _resize(Q, (w, h), cv2.INTER_LINEAR)
+    return Q
+
+
+def crf_argmax(img, **kwargs):
+    return np.argmax(crf_inference(img, **kwargs), axis=0).astype(np.uint8)
+
+
+def _crf_predict(func, *args, **kwargs):
+    # label map of a CRF function returning C x H x W marginals
+    return np.argmax(func(*args, **kwargs), axis=0)
+
+
+class CRFPool():
+    """crf_inference (or crf_argmax with argmax=True) in a pool of worker processes.
+
+    func replaces crf_inference by another CRF function returning C x H x W marginals
+    (e.g. the segmentation utils.DenseCRF.dense_crf), argmax=True then gives its argmax.
+
+    submit() takes the arguments of the function and returns a multiprocessing AsyncResult,
+    map() runs a list of jobs and keeps their order. The keyword arguments of the constructor
+    (t, scale_factor, pairwise parameters, ...) are shared by every job. With num_workers = 0
+    the jobs run in the calling process.
+    """
+
+    def __init__(self, num_workers=8, argmax=False, func=None, **kwargs):
+        if func is None:
+            func = crf_argmax if argmax else crf_inference
+        elif argmax:
+            func = functools.partial(_crf_predict, func)
+        self.func = functools.partial(func, **kwargs)
+        self.pool = multiprocessing.Pool(num_workers) if num_workers > 0 else None
+
+    def submit(self, *args, **kwargs):
+        if self.pool is None:
+            return _Done(self.func(*args, **kwargs))
+        return self.pool.apply_async(self.func, args, kwargs)
+
+    def map(self, jobs):
+        # jobs: list of keyword argument dicts (dict(img=..., labels=...)) or positional argument tuples
+        results = [self.submit(**job) if isinstance(job, dict) else self.submit(*job) for job in jobs]
+        return [r.get() for r in results]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Done():
+    # AsyncResult interface for a result computed in place
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self, timeout=None):
+        return self.value
+
+
+def probs_from_labels(labels, n_labels=21, gt_prob=0.7):
+    # N x H x W label map -> N x n_labels x H x W probabilities, as unary_from_labels(zero_unsure=False)
+    other = (1 - gt_prob) / (n_labels - 1)
+    probs = F.one_hot(labels.long(), n_labels).permute(0, 3, 1, 2).float()
+    return probs * (gt_prob - other) + other
+
+
+def _gaussian_filter(x, sigma):
+    # separable gaussian blur of N x C x H x W, 1 at the center (no normalization), zero padding
+    r = max(1, int(math.ceil(3 * sigma)))
+    k = torch.exp(-torch.arange(-r, r + 1, dtype=x.dtype, device=x.device) ** 2 / (2 * sigma ** 2))
+    c = x.size(1)
+    x = F.conv2d(x, k.view(1, 1, 1, -1).repeat(c, 1, 1, 1), padding=(0, r), groups=c)
+    return F.conv2d(x, k.view(1, 1, -1, 1).repeat(c, 1, 1, 1), padding=(r, 0), groups=c)
+
+
+class _BilateralGrid():
+    # Sparse bilateral grid over the (x, y, r, g, b) / std features of every pixel of a batch.
+    # A pixel is splatted to its nearest cell, the occupied cells are blurred with [1 2 1] along
+    # each of the 5 axes and the result is sliced back at the pixel's cell. With a cell of
+    # sqrt(1.5) standard deviations, the blur and the rounding of splat and slice add up to
+    # a unit variance gaussian per axis.
+    CELL = math.sqrt(1.5)
+
+    def __init__(self, img, sxy, srgb):
+        n, _, h, w = img.shape
+        ys, xs = torch.meshgrid(torch.arange(h, dtype=torch.float32, device=img.device),
+                                torch.arange(w, dtype=torch.float32, device=img.device), indexing='ij')
+        pos = torch.stack([xs, ys]).unsqueeze(0).expand(n, 2, h, w) / sxy
+        feat = torch.cat([pos, img.float() / srgb], dim=1)
+        coords = torch.round(feat / self.CELL).long().permute(1, 0, 2, 3).reshape(5, -1)
+        coords = coords - coords.min(1, keepdim=True)[0] + 1
+        sizes = (coords.max(1)[0] + 2).tolist()
+
+        # one int64 key per cell, the image index is the most significant digit
+        key = torch.arange(n, device=img.device).view(n, 1).expand(n, h * w).reshape(-1)
+        for d in range(5):
+            key = key * sizes[d] + coords[d]
+        self.keys, self.index = torch.unique(key, return_inverse=True)
+
+        # the two neighbours of every cell along each axis, with a mask of the occupied ones
+        m = self.keys.numel()
+        self.neighbours = []
+        stride = 1
+        for d in reversed(range(5)):
+            pair = []
+            for offset in (stride, -stride):
+                nb = self.keys + offset
+                idx = torch.searchsorted(self.keys, nb).clamp(max=m - 1)
+                pair.append((idx, (self.keys[idx] == nb).float().unsqueeze(1)))
+            self.neighbours.append(pair)
+            stride *= sizes[d]
+
+    def filter(self, v):
+        # v: (N * H * W) x C values of the pixels
+        grid = v.new_zeros(self.keys.numel(), v.size(1)).index_add_(0, self.index, v)
+        for (ip, vp), (im, vm) in self.neighbours:
+            grid = 0.5 * grid + 0.25 * (grid[ip] * vp + grid[im] * vm)
+        return grid[self.index]
+
+
+class MeanFieldCRF(nn.Module):
+    """Dense CRF mean-field inference in PyTorch for a batch of N x C x H x W probabilities.
+
+    Same model and update as crf_inference (potts compatibility, symmetric normalization of
+    both kernels), without the permutohedral lattice: the gaussian kernel is an exact separable
+    convolution, the bilateral kernel is filtered on a sparse bilateral grid (_BilateralGrid).
+    Runs on the device of its inputs, so the refinement can stay on the GPU next to the network.
+
+    forward(probs, img): img is N x 3 x H x W RGB in 0-255, returns the N x C x H x W marginals.
+    scale_factor > 1 is the downsampled mode of crf_inference.
+    """
+
+    def __init__(self, t=10, scale_factor=1, pos_sxy=3, pos_compat=3, bi_sxy=80, bi_srgb=13, bi_compat=10):
+        super(MeanFieldCRF, self).__init__()
+        self.t = t
+        self.scale_factor = scale_factor
+        self.pos_sxy = pos_sxy
+        self.pos_compat = pos_compat
+        self.bi_sxy = bi_sxy
+        self.bi_srgb = bi_srgb
+        self.bi_compat = bi_compat
+
+    @torch.no_grad()
+    def forward(self, probs, img):
+        n, c, h, w = probs.shape
+        probs = probs.float()
+        img = img.float()
+        if self.scale_factor != 1:
+            size = (max(1, int(round(h / self.scale_factor))), max(1, int(round(w / self.scale_factor))))
+            probs = F.interpolate(probs, size, mode='area')
+            img = F.interpolate(img, size, mode='area')
+        ch, cw = probs.shape[2:]
+
+        unary = torch.log(probs.clamp(1e-5, 1))
+        pos_sxy = self.pos_sxy / self.scale_factor
+        pos_norm = torch.rsqrt(_gaussian_filter(probs.new_ones(n, 1, ch, cw), pos_sxy) + 1e-20)
+        grid = _BilateralGrid(img, self.bi_sxy / self.scale_factor, self.bi_srgb)
+        bi_norm = torch.rsqrt(grid.filter(probs.new_ones(n * ch * cw, 1)) + 1e-20)
+
+        Q = F.softmax(unary, dim=1)
+        for _ in range(self.t):
+            bi = bi_norm * grid.filter(bi_norm * Q.permute(0, 2, 3, 1).reshape(-1, c))
+            bi = bi.view(n, ch, cw, c).permute(0, 3, 1, 2)
+            pos = pos_norm * _gaussian_filter(pos_norm * Q, pos_sxy)
+            Q = F.softmax(unary + self.pos_compat * pos + self.bi_compat * bi, dim=1)
+
+        if self.scale_factor != 1:
+            Q = F.interpolate(Q, (h, w), mode='bilinear', align_corners=False)
+        return Q
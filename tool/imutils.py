@@ -66,6 +66,22 @@ class RandomCrop():
 
         return container
 
+class RandomCropBox():
+    """RandomCrop for uint8 images that also returns the (top, bottom, left, right) box of
+    the image inside the container, so padding can be masked after normalization."""
+
+    def __init__(self, cropsize):
+        self.cropsize = cropsize
+
+    def __call__(self, imgarr):
+
+        box = get_random_crop_box(imgarr.shape[:2], self.cropsize)
+
+        container = np.zeros((self.cropsize, self.cropsize, imgarr.shape[-1]), imgarr.dtype)
+        container[box[0]:box[1], box[2]:box[3]] = imgarr[box[4]:box[5], box[6]:box[7]]
+
+        return container, np.array(box[:4], np.int64)
+
 def get_random_crop_box(imgsize, cropsize):
     h, w = imgsize
 
@@ -127,6 +143,59 @@ def random_crop(images, cropsize, fills):
     return new_images
 
 
+def _blend(degenerate, img, factor):
+    # PIL's ImagingBlend in numpy: float32 degenerate + factor * (img - degenerate), clipped and truncated
+    out = np.subtract(img, degenerate, dtype=np.int32).astype(np.float32)
+    out *= np.float32(factor)
+    out += degenerate
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+class ColorJitter():
+    """Fast path of torchvision.transforms.ColorJitter for PIL RGB images, with the same
+    random draws, returning a H x W x 3 uint8 array (np.asarray is a no-op on it).
+
+    brightness and contrast are per-value blends and go through one 256 entry cv2.LUT
+    (same values as PIL), saturation is PIL's blend with the gray image. hue uses cv2's
+    float hsv conversions with PIL's 0-255 quantization of h and s instead of PIL's own,
+    ~5x slower conversions. About 0.5% of the colors get h one step off, which moves them
+    by up to 6 grey levels (8 after a later brightness/contrast step); on a smooth image
+    ~0.2% of the values differ from torchvision and the mean difference is ~0.004 grey
+    levels (tests/test_color_jitter.py)."""
+
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0):
+        import torchvision
+        self.jitter = torchvision.transforms.ColorJitter(brightness=brightness, contrast=contrast,
+                                                         saturation=saturation, hue=hue)
+        self.index = np.arange(256, dtype=np.uint8)
+
+    def __call__(self, img):
+        import cv2
+
+        fn_idx, brightness, contrast, saturation, hue = self.jitter.get_params(
+            self.jitter.brightness, self.jitter.contrast, self.jitter.saturation, self.jitter.hue)
+        img = np.asarray(img, dtype=np.uint8)
+        for fn_id in fn_idx:
+            if fn_id == 0 and brightness is not None:
+                img = cv2.LUT(img, _blend(0, self.index, brightness))
+            elif fn_id == 1 and contrast is not None:
+                # ImageEnhance.Contrast blends with the rounded mean of the gray image
+                mean = int(cv2.mean(np.asarray(PIL.Image.fromarray(img).convert('L')))[0] + 0.5)
+                img = cv2.LUT(img, _blend(mean, self.index, contrast))
+            elif fn_id == 2 and saturation is not None:
+                pil = PIL.Image.fromarray(img)
+                img = np.asarray(PIL.Image.blend(pil.convert('L').convert('RGB'), pil, saturation))
+            elif fn_id == 3 and hue is not None:
+                hsv = cv2.cvtColor(img.astype(np.float32), cv2.COLOR_RGB2HSV)
+                # PIL truncates h (degrees here) and s to 0-255, the shift wraps around as in torchvision
+                h = (hsv[..., 0] * np.float32(255. / 360.)).astype(np.uint8) + np.int32(hue * 255).astype(np.uint8)
+                hsv[..., 0] = h * np.float32(360. / 255.)
+                hsv[..., 1] = np.floor(hsv[..., 1] * 255.) / 255.
+                img = np.rint(cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)).astype(np.uint8)
+        return img
+
+
 class AvgPool2d():
 
     def __init__(self, ksize):
@@ -206,6 +275,26 @@ def HWC_to_CHW(tensor, sal=False):
     return tensor
 
 
+class PadToMultiple():
+    def __init__(self, unit, default_value=0):
+        self.unit = unit
+        self.default_value = default_value
+
+    def __call__(self, npimg):
+        h, w = npimg.shape[:2]
+
+        ph = int(np.ceil(h / self.unit) * self.unit)
+        pw = int(np.ceil(w / self.unit) * self.unit)
+
+        if ph == h and pw == w:
+            return npimg
+
+        container = np.full((ph, pw) + npimg.shape[2:], self.default_value, npimg.dtype)
+        container[:h, :w] = npimg
+
+        return container
+
+
 class RescaleNearest():
     def __init__(self, scale):
         self.scale = scale
@@ -218,20 +307,8 @@ class RescaleNearest():
 
 
 def crf_inference(img, probs, t=10, scale_factor=1, labels=21):
-    import pydensecrf.densecrf as dcrf
-    from pydensecrf.utils import unary_from_softmax
-
-    h, w = img.shape[:2]
-    n_labels = labels
-
-    d = dcrf.DenseCRF2D(w, h, n_labels)
-
-    unary = unary_from_softmax(probs)
-    unary = np.ascontiguousarray(unary)
-
-    d.setUnaryEnergy(unary)
-    d.addPairwiseGaussian(sxy=3/scale_factor, compat=3)
-    d.addPairwiseBilateral(sxy=80/scale_factor, srgb=13, rgbim=np.copy(img), compat=10)
-    Q = d.inference(t)
+    # see tool.crf.crf_inference, scale_factor > 1 runs the CRF downsampled
+    from tool import crf
 
-    return np.array(Q).reshape((n_labels, h, w))
+    return crf.crf_inference(img, probs=probs, t=t, n_labels=labels, scale_factor=scale_factor,
+                             **crf.CRF_PARAMS['cam'])
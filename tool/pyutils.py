@@ -2,6 +2,11 @@
 import numpy as np
 import time
 import sys
+import atexit
+import queue
+import threading
+import traceback
+import cv2
 
 class Logger(object):
     def __init__(self, outfile):
@@ -120,6 +125,92 @@ class BatchThreader:
         return rtn
 
 
+class AsyncWriter:
+    """Write result files (png / npy) from background threads.
+
+    Jobs go through a bounded queue, so a slow disk throttles the producer instead of
+    piling up results in memory. flush() waits until everything queued is written and
+    re-raises the first error of a writer thread. close() also runs at interpreter exit,
+    where a pending error is printed to stderr instead of raised.
+
+    Images are written with cv2, so 3-channel images are expected in BGR order;
+    png_compression is the PNG compression level 0-9, None for the cv2 default.
+    Shared with the segmentation library (segmentation/lib/datasets/BaseDataset.py)."""
+
+    def __init__(self, num_threads=4, max_queue=64, png_compression=None):
+        self.png_compression = png_compression
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.errors = []
+        self.threads = [threading.Thread(target=self.__worker, daemon=True) for _ in range(num_threads)]
+        for t in self.threads:
+            t.start()
+        self.closed = False
+        atexit.register(self.__close_at_exit)
+
+    def __worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def write_image(self, file_path, img):
+        # synchronous, runs in the calling thread
+        params = []
+        if self.png_compression is not None and file_path.endswith('.png'):
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        if not cv2.imwrite(file_path, img, params):
+            raise IOError('AsyncWriter: could not write %s' % file_path)
+
+    def submit(self, func, *args):
+        if self.closed:
+            raise RuntimeError('AsyncWriter: writer is closed')
+        self.queue.put((func, args))
+
+    def imwrite(self, file_path, img):
+        self.submit(self.write_image, file_path, img)
+
+    def save_npy(self, file_path, arr):
+        self.submit(np.save, file_path, arr)
+
+    def flush(self):
+        self.queue.join()
+        if len(self.errors) > 0:
+            errors, self.errors = self.errors, []
+            raise errors[0]
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            for _ in self.threads:
+                self.queue.put(None)
+            for t in self.threads:
+                t.join()
+
+    def __close_at_exit(self):
+        try:
+            self.close()
+        except Exception:
+            sys.stderr.write('AsyncWriter: a background write failed\n')
+            traceback.print_exc()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 
 
 def get_indices_of_pairs(radius, size):
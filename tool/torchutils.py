@@ -1,12 +1,14 @@
 
+import contextlib
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from PIL import Image
 import os.path
 import random
 import numpy as np
 from tool import imutils
 import torch.nn.functional as F
+import torch.utils.checkpoint
 
 class PolyOptimizer(torch.optim.SGD):
 
@@ -81,6 +83,341 @@ class BatchNorm2dFixed(torch.nn.Module):
         return self.forward(x)
 
 
+def get_device(device=None, num_threads=0, num_interop_threads=0):
+    """Resolve a --device string ('cpu', 'cuda', 'cuda:1'; None picks cuda when available)
+    and apply the intra-/inter-op thread counts for CPU runs (0 keeps the torch default)."""
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(device)
+
+    if device.type == 'cuda' and not torch.cuda.is_available():
+        raise ValueError('get_device: %s requested but cuda is not available' % device)
+
+    if device.type == 'cpu':
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        if num_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(num_interop_threads)
+            except RuntimeError:
+                # can only be set once, before any inter-op parallel work has started
+                print('get_device: inter-op threads already initialized, keeping %d'
+                      % torch.get_num_interop_threads())
+
+    return device
+
+
+def data_parallel(model, device):
+    """Move model to device. A bare 'cuda' device spreads batches over all visible GPUs
+    with DataParallel, 'cuda:i' pins a single GPU and 'cpu' leaves the model unwrapped."""
+    if device.type != 'cuda':
+        return model.to(device)
+
+    device_ids = None if device.index is None else [device.index]
+    return torch.nn.DataParallel(model, device_ids=device_ids).to(device)
+
+
+def bf16_supported(device):
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    return device.type == 'cpu'
+
+
+def autocast(device, enabled=True):
+    """bf16 autocast on device, or a no-op context when disabled."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def normalize_batch(img, mean, std):
+    """Normalize a uint8 N x 3 x H x W batch on its device like network.resnet38d.Normalize
+    does per image on the workers. Float input is taken as already normalized."""
+    if img.dtype != torch.uint8:
+        return img
+    mean = torch.tensor(mean, dtype=torch.float32, device=img.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=torch.float32, device=img.device).view(1, 3, 1, 1)
+    return (img.float() / 255. - mean) / std
+
+
+def _pcm_block(cam, f, f_block):
+    aff = F.relu(torch.matmul(f.transpose(1, 2), f_block), inplace=True)
+    aff = aff / (torch.sum(aff, dim=1, keepdim=True) + 1e-5)
+    return torch.matmul(cam, aff)
+
+
+def pixel_correlation(cam, f, max_mb=0):
+    """cam (n x c x hw) @ relu(f^T f) with column-normalized affinity, f (n x d x hw) being
+    the l2-normalized features of the PCM.
+
+    The affinity is symmetric, so every block of output columns only needs the matching
+    block of affinity columns and their sums. With max_mb > 0 the columns are processed in
+    blocks whose affinity stays below max_mb megabytes instead of forming the full
+    hw x hw matrix; blocks are recomputed in backward when gradients are needed."""
+    n, _, hw = f.size()
+
+    block = hw
+    if max_mb > 0:
+        block = max(1, int(max_mb * 2 ** 20) // (n * hw * f.element_size()))
+    if block >= hw:
+        return _pcm_block(cam, f, f)
+
+    cam_rv = []
+    for i in range(0, hw, block):
+        f_block = f[:, :, i:i + block]
+        if torch.is_grad_enabled():
+            cam_rv.append(torch.utils.checkpoint.checkpoint(_pcm_block, cam, f, f_block, use_reentrant=False))
+        else:
+            cam_rv.append(_pcm_block(cam, f, f_block))
+
+    return torch.cat(cam_rv, dim=2)
+
+
+def get_transition_matrix(aff_mat, beta):
+    """Raise the affinities to beta and normalize every column to sum to one.
+    aff_mat can be a dense or a sparse COO matrix; the result has the same layout."""
+    if aff_mat.is_sparse:
+        aff_mat = aff_mat.coalesce()
+        indices = aff_mat.indices()
+        values = torch.pow(aff_mat.values(), beta)
+
+        col_sum = torch.zeros(aff_mat.size(1), dtype=values.dtype, device=values.device)
+        col_sum.index_add_(0, indices[1], values)
+
+        return torch.sparse_coo_tensor(indices, values / col_sum[indices[1]], aff_mat.size()).coalesce()
+
+    aff_mat = torch.pow(aff_mat, beta)
+    return aff_mat / torch.sum(aff_mat, dim=0, keepdim=True)
+
+
+def _rw_matmul(a, b):
+    if b.is_sparse:
+        if a.is_sparse:
+            return torch.sparse.mm(a, b).coalesce()
+        return torch.sparse.mm(b.t(), a.t()).t()
+    return torch.matmul(a, b)
+
+
+def random_walk(cam_vec, trans_mat, logt, tol=0., mode='square'):
+    """Propagate cam_vec (C x N) with trans_mat^(2^logt).
+
+    mode='square' squares trans_mat logt times; mode='power' multiplies cam_vec by
+    trans_mat up to 2^logt times instead. trans_mat may be a sparse COO matrix: squaring
+    would fill it in (back to N x N memory, slower than dense matmuls), so in square mode
+    the same cam_vec x trans_mat^(2^i) steps are made of sparse matrix-vector products.
+
+    With tol > 0 the walk stops once the relative change of the propagated cam between
+    two steps falls below tol. This trades accuracy for iterations: a small change per
+    step does not bound the distance to the trans_mat^(2^logt) result (on AffinityNet
+    transition matrices, tol=1e-3 stopped power mode after 34 of 64 iterations, 0.059
+    off the trans_mat^64 cam). Returns the cam and the number of squarings / power
+    iterations done."""
+
+    def _change(cam_new, cam_old):
+        return (torch.norm(cam_new - cam_old) / (torch.norm(cam_old) + 1e-5)).item()
+
+    if mode == 'square' and trans_mat.is_sparse:
+        cam_rw = _rw_matmul(cam_vec, trans_mat)
+        for i in range(logt):
+            cam_new = cam_rw
+            for _ in range(2 ** i):
+                cam_new = _rw_matmul(cam_new, trans_mat)
+            if tol > 0 and _change(cam_new, cam_rw) < tol:
+                return cam_new, i + 1
+            cam_rw = cam_new
+        return cam_rw, logt
+
+    elif mode == 'square':
+        cam_rw = _rw_matmul(cam_vec, trans_mat)
+        for i in range(logt):
+            trans_mat = _rw_matmul(trans_mat, trans_mat)
+            if tol > 0:
+                cam_new = _rw_matmul(cam_vec, trans_mat)
+                if _change(cam_new, cam_rw) < tol:
+                    return cam_new, i + 1
+                cam_rw = cam_new
+
+        if tol > 0:
+            return cam_rw, logt
+        return _rw_matmul(cam_vec, trans_mat), logt
+
+    elif mode == 'power':
+        cam_rw = cam_vec
+        for i in range(2 ** logt):
+            cam_new = _rw_matmul(cam_rw, trans_mat)
+            if tol > 0 and _change(cam_new, cam_rw) < tol:
+                return cam_new, i + 1
+            cam_rw = cam_new
+
+        return cam_rw, 2 ** logt
+
+    else:
+        raise ValueError('random_walk: mode %s is not supported' % mode)
+
+
+class BucketBatchSampler(Sampler):
+    """Batch together indices sharing the same bucket key (e.g. padded image size),
+    so that every batch can be stacked without extra padding."""
+
+    def __init__(self, bucket_keys, batch_size, drop_last=False):
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+        self.buckets = dict()
+        for idx, key in enumerate(bucket_keys):
+            self.buckets.setdefault(key, []).append(idx)
+
+    def __iter__(self):
+        for indices in self.buckets.values():
+            for i in range(0, len(indices), self.batch_size):
+                batch = indices[i:i + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(v) // self.batch_size for v in self.buckets.values())
+        return sum((len(v) + self.batch_size - 1) // self.batch_size for v in self.buckets.values())
+
+
+class RescaledView():
+    """Turn a CHW tensor into (img, img bilinearly resized to size), so that the second
+    view of contrast training is made by the data loader workers."""
+
+    def __init__(self, size, align_corners=True):
+        self.size = size
+        self.align_corners = align_corners
+
+    def __call__(self, img):
+        img_s = F.interpolate(img.unsqueeze(0), size=self.size, mode='bilinear',
+                              align_corners=self.align_corners)[0]
+        return img, img_s
+
+
+class MultiViewForward(torch.nn.Module):
+    """Run module on every input view and return the tuple of outputs. Wrapped in
+    DataParallel, all views go through a single scatter / gather round."""
+
+    def __init__(self, module):
+        super(MultiViewForward, self).__init__()
+        self.module = module
+
+    def forward(self, *views):
+        return tuple(self.module(v) for v in views)
+
+
+def _rgb_to_gray(img):
+    return (0.299 * img[:, 0] + 0.587 * img[:, 1] + 0.114 * img[:, 2]).unsqueeze(1)
+
+
+def _rgb_to_hsv(img):
+    r, g, b = img.unbind(dim=1)
+    maxc = torch.max(img, dim=1)[0]
+    minc = torch.min(img, dim=1)[0]
+
+    cr = maxc - minc
+    s = cr / torch.where(maxc == 0, torch.ones_like(maxc), maxc)
+    cr_div = torch.where(cr == 0, torch.ones_like(cr), cr)
+    rc = (maxc - r) / cr_div
+    gc = (maxc - g) / cr_div
+    bc = (maxc - b) / cr_div
+
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+
+    return h, s, maxc
+
+
+def _hsv_to_rgb(h, s, v):
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.long() % 6
+
+    p = torch.clamp(v * (1.0 - s), 0.0, 1.0)
+    q = torch.clamp(v * (1.0 - s * f), 0.0, 1.0)
+    t = torch.clamp(v * (1.0 - s * (1.0 - f)), 0.0, 1.0)
+
+    mask = (i.unsqueeze(1) == torch.arange(6, device=i.device).view(-1, 1, 1)).to(v.dtype)
+    a1 = torch.stack((v, q, p, p, t, v), dim=1)
+    a2 = torch.stack((t, v, v, q, p, p), dim=1)
+    a3 = torch.stack((p, p, t, v, v, q), dim=1)
+
+    return torch.stack([torch.sum(mask * a, dim=1) for a in (a1, a2, a3)], dim=1)
+
+
+class BatchAugment():
+    """On-device version of the contrast training augmentation (ColorJitter, horizontal flip,
+    Normalize and the zero padding of RandomCrop) applied to a whole batch at once.
+
+    Takes the N x H x W x 3 uint8 crops and N x 4 (top, bottom, left, right) image boxes
+    made by imutils.RandomCropBox and returns normalized N x 3 x H x W float images. Jitter
+    factors are drawn per image, in one random order per batch like ColorJitter."""
+
+    def __init__(self, mean, std, brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1, hflip=True):
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.hflip = hflip
+
+    @staticmethod
+    def _factor(n, amount, device):
+        # brightness / contrast / saturation factor in [max(0, 1 - amount), 1 + amount], as ColorJitter
+        return torch.empty(n, 1, 1, 1, device=device).uniform_(max(0., 1. - amount), 1. + amount)
+
+    @staticmethod
+    def _shift(n, amount, device):
+        # hue shift in [-amount, amount], as ColorJitter
+        return torch.empty(n, 1, 1, 1, device=device).uniform_(-amount, amount)
+
+    def __call__(self, img, box):
+
+        n, h, w, _ = img.size()
+        device = img.device
+
+        img = img.permute(0, 3, 1, 2).float() / 255.
+
+        ys = torch.arange(h, device=device).view(1, h, 1)
+        xs = torch.arange(w, device=device).view(1, 1, w)
+        box = box.to(device)
+        mask = (ys >= box[:, 0].view(-1, 1, 1)) & (ys < box[:, 1].view(-1, 1, 1)) & \
+               (xs >= box[:, 2].view(-1, 1, 1)) & (xs < box[:, 3].view(-1, 1, 1))
+        mask = mask.unsqueeze(1).float()
+
+        for t in torch.randperm(4).tolist():
+            if t == 0 and self.brightness > 0:
+                img = torch.clamp(img * self._factor(n, self.brightness, device), 0., 1.)
+
+            elif t == 1 and self.contrast > 0:
+                gray_mean = torch.sum(_rgb_to_gray(img) * mask, dim=(1, 2, 3), keepdim=True) / \
+                            torch.clamp(torch.sum(mask, dim=(1, 2, 3), keepdim=True), min=1.)
+                factor = self._factor(n, self.contrast, device)
+                img = torch.clamp(factor * img + (1 - factor) * gray_mean, 0., 1.)
+
+            elif t == 2 and self.saturation > 0:
+                factor = self._factor(n, self.saturation, device)
+                img = torch.clamp(factor * img + (1 - factor) * _rgb_to_gray(img), 0., 1.)
+
+            elif t == 3 and self.hue > 0:
+                hue, sat, val = _rgb_to_hsv(img)
+                hue = torch.fmod(hue + self._shift(n, self.hue, device).view(n, 1, 1) + 1., 1.)
+                img = _hsv_to_rgb(hue, sat, val)
+
+        if self.hflip:
+            flip = (torch.rand(n, 1, 1, 1, device=device) < 0.5).float()
+            img = flip * torch.flip(img, [3]) + (1 - flip) * img
+            mask = flip * torch.flip(mask, [3]) + (1 - flip) * mask
+
+        img = (img - self.mean.to(device)) / self.std.to(device)
+
+        return img * mask
+
+
 class SegmentationDataset(Dataset):
     def __init__(self, img_name_list_path, img_dir, label_dir, rescale=None, flip=False, cropsize=None,
                  img_transform=None, mask_transform=None):
@@ -2,8 +2,7 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 import cv2
-import pydensecrf.densecrf as dcrf
-from pydensecrf.utils import unary_from_softmax
+from tool.crf import crf_inference, CRF_PARAMS
 
 def color_pro(pro, img=None, mode='hwc'):
 	H, W = pro.shape
@@ -97,7 +96,7 @@ def ColorCLS(prob, func_label2color):
 	CLS = func_label2color(prob_idx).transpose((2,0,1))
 	return CLS
 	
-def VOClabel2colormap(label):
+def _VOClabel2colormap(label):
 	m = label.astype(np.uint8)
 	r,c = m.shape
 	cmap = np.zeros((r,c,3), dtype=np.uint8)
@@ -107,20 +106,16 @@ def VOClabel2colormap(label):
 	cmap[m==255] = [255,255,255]
 	return cmap
 
+# 256 x 3 palette: the bit twiddling above evaluated once for every label value
+VOC_PALETTE = _VOClabel2colormap(np.arange(256).reshape(1,256))[0]
+
+def VOClabel2colormap(label):
+	return VOC_PALETTE[label.astype(np.uint8)]
+
 def dense_crf(probs, img=None, n_classes=21, n_iters=1, scale_factor=1):
 	c,h,w = probs.shape
 	if img is not None:
 		assert(img.shape[1:3] == (h, w))
 		img = np.transpose(img,(1,2,0)).copy(order='C')
 
-	d = dcrf.DenseCRF2D(w, h, n_classes) # Define DenseCRF model.
-
-	unary = unary_from_softmax(probs)
-	unary = np.ascontiguousarray(unary)
-	d.setUnaryEnergy(unary)
-	d.addPairwiseGaussian(sxy=3/scale_factor, compat=3)
-	d.addPairwiseBilateral(sxy=80/scale_factor, srgb=13, rgbim=np.copy(img), compat=10)
-	Q = d.inference(n_iters)
-
-	preds = np.array(Q, dtype=np.float32).reshape((n_classes, h, w))
-	return preds
+	return crf_inference(img, probs=probs, t=n_iters, n_labels=n_classes, scale_factor=scale_factor, **CRF_PARAMS['cam'])
@@ -46,6 +46,15 @@ def load_image_label_list_from_npy(img_name_list):
 def get_img_path(img_name, voc12_root):
     return os.path.join(voc12_root, IMG_FOLDER_NAME, img_name + '.jpg')
 
+def load_img_size_list(img_name_list, voc12_root):
+    # PIL only parses the header here, so no pixel data is decoded
+    size_list = []
+    for img_name in img_name_list:
+        with PIL.Image.open(get_img_path(img_name, voc12_root)) as img:
+            size_list.append((img.size[1], img.size[0]))
+
+    return size_list
+
 def load_img_name_list(dataset_path):
 
     img_gt_name_list = open(dataset_path).read().splitlines()